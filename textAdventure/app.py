@@ -1,554 +1,755 @@
-from flask import Flask, render_template, redirect, request, session
+# when the app started loading, the startup times /ready reports are counted from here
+import time
+STARTED = time.perf_counter()
+
+from flask import Flask, render_template, redirect, request, session, g, jsonify, has_request_context
+from jinja2 import FileSystemBytecodeCache
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.local import LocalProxy
+from werkzeug.security import safe_join
 
 app = Flask(__name__, static_folder='static')
 
+import copy
+import hashlib
 import secrets
 import os
+import sys
+import threading
 import uuid
+from functools import lru_cache
+
+from engine import Engine, unpack_state, pack_state
+from event_log import EventLog, EVENT_CODES, replay
+from fragments import FragmentCache
+from http_cache import compress_response, etag_matches, not_modified, file_hash
+from metrics import Metrics, SamplingProfiler, TIME_BUCKETS, SIZE_BUCKETS, LINE_BUCKETS
+from snapshot import encode_snapshot, decode_snapshot, MAX_SNAPSHOT_SIZE
+from state_store import create_store, encode_state
+from story_log import StoryLog
+from world import build_world
+
+def load_secret_key(): 
+    # the key that signs the session cookie has to be the same in every worker and survive restarts,
+    # otherwise a request that lands on another worker can't read its user_id and the game starts over
+    # SECRET_KEY wins, otherwise one is generated once and kept in SECRET_KEY_FILE
+    if os.environ.get('SECRET_KEY'): 
+        return os.environ['SECRET_KEY']
+    path = os.environ.get('SECRET_KEY_FILE', os.path.join(app.instance_path, 'secret_key'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try: 
+        # O_EXCL so if several workers start at once only one of them writes the key
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError: 
+        with open(path) as f: 
+            key = f.read().strip()
+        if key: 
+            return key
+        # another worker created the file but hasn't written it yet
+        time.sleep(0.1)
+        with open(path) as f: 
+            return f.read().strip()
+    key = secrets.token_hex()
+    with os.fdopen(fd, 'w') as f: 
+        f.write(key)
+    return key
+
+
+app.secret_key = load_secret_key()
+
+# built once and shared by every player
+world = build_world()
+
+# game state is kept server side, the session cookie only holds the user_id
+store = create_store()
+
+# loaded once in load_state() and written back once in save_state()
+state = LocalProxy(lambda: g.state)
+
+# games held in memory by open websockets (see asgi.py), by user_id: [state, number of open sockets]
+# a player's HTTP requests play on that same state while a socket has it, the copy in the store can be
+# up to WEBSOCKET_SAVE_EVERY actions behind
+live_games = {}
+
+# whatever plays a player's game (an HTTP request from load_state() to its teardown, a websocket action,
+# a socket opening or closing) holds the player's lock, so a game is never played on or saved by two at once
+# players share locks between them (by hash), so there is a fixed number of them however many players there are
+PLAYER_LOCKS = [threading.Lock() for _ in range(256)]
+
+
+def player_lock(user_id): 
+    return PLAYER_LOCKS[hash(user_id) % len(PLAYER_LOCKS)]
+
+
+# only the newest STORY_BUFFER_SIZE lines of the story are kept in the game state,
+# older lines are moved to the player's story log and loaded through /history when scrolled back to
+app.config['STORY_BUFFER_SIZE'] = int(os.environ.get('STORY_BUFFER_SIZE', 200))
+story_log = StoryLog(os.environ.get('STORY_LOG_DIR', 'story_logs'))
+
+# every action a player takes is appended to their action log, with a save file of the game every
+# EVENT_SNAPSHOT_EVERY actions, so a lost state can be rebuilt and games can be replayed (see event_log.py and replay.py)
+app.config['EVENT_SNAPSHOT_EVERY'] = int(os.environ.get('EVENT_SNAPSHOT_EVERY', 100))
+event_log = EventLog(os.environ.get('EVENT_LOG_DIR', 'event_logs'))
+
+# no request needs a body bigger than a save file (see /restore), with room for a form upload's headers
+app.config['MAX_CONTENT_LENGTH'] = MAX_SNAPSHOT_SIZE + 64 * 1024
+
+# how many tiles around the player the map shows in each direction
+app.config['MAP_VIEW_RADIUS'] = int(os.environ.get('MAP_VIEW_RADIUS', 7))
+
+# rendered room descriptions, help text and map legend, shared by every player
+fragments = FragmentCache(world, capacity=int(os.environ.get('FRAGMENT_CACHE_SIZE', 4096)))
+
+# compiled templates are kept on disk (TEMPLATE_CACHE_DIR, empty turns it off), so a new process loads them
+# instead of compiling them again
+template_cache = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'template_cache'))
+if template_cache: 
+    os.makedirs(template_cache, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(template_cache)
+
+# responses with at least COMPRESS_MIN_SIZE bytes of text are compressed (0 turns compression off)
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+# METRICS=1 times every request and its phases and serves the numbers on /metrics (see metrics.py)
+# PROFILER=1 starts the sampling profiler as well, it can also be switched on and off through /profile
+# it is started by the first request rather than at import: with gunicorn's preload_app the app is imported
+# before the workers are forked, and a thread started then would only run in the master
+metrics = Metrics(enabled=os.environ.get('METRICS') == '1')
+profiler = SamplingProfiler(interval=float(os.environ.get('PROFILER_INTERVAL', 0.005)))
+profiler_autostart = os.environ.get('PROFILER') == '1'
+
+# requests that never touch a player's game
+STATELESS_ENDPOINTS = ('static', 'welcome', 'metrics', 'profile', 'ready')
+
+# seconds from STARTED until the app was imported, warmed up (see warm_up()) and sent its first response
+startup = {'imported': None, 'warmed': None, 'first_response': None}
+
+
+def phase(name): 
+    # times a part of the current request (or websocket action) if metrics are on
+    if not metrics.enabled: 
+        return metrics.phase(name, None)
+    return metrics.phase(name, (request.endpoint or 'unknown') if has_request_context() else 'websocket')
+
+
+class TimedSessionInterface(SecureCookieSessionInterface): 
+    # the normal signed cookie session, with reading and signing the cookie timed
+    def open_session(self, app, request): 
+        cookie = request.cookies.get(app.session_cookie_name)
+        if cookie: 
+            metrics.observe('game_session_cookie_bytes', len(cookie))
+        start = time.perf_counter()
+        opened = super().open_session(app, request)
+        # the url isn't matched to a route yet at this point, record_request() records it once it is
+        g.session_decode_seconds = time.perf_counter() - start
+        return opened
+
+    def save_session(self, app, session, response): 
+        with phase('cookie_sign'): 
+            super().save_session(app, session, response)
+
+
+if metrics.enabled: 
+    metrics.counter('game_requests_total', "Requests handled, by route and status")
+    metrics.histogram('game_request_seconds', "Time from the first to the last request hook, by route", TIME_BUCKETS)
+    metrics.histogram('game_phase_seconds', "Time spent in each phase of a request, by route and phase", TIME_BUCKETS)
+    metrics.histogram('game_session_cookie_bytes', "Size of the session cookie sent by the browser", SIZE_BUCKETS)
+    metrics.histogram('game_state_bytes', "Size of a player's encoded game state when it is saved", SIZE_BUCKETS)
+    metrics.histogram('game_story_lines', "Lines in a player's story buffer when it is saved", LINE_BUCKETS)
+    app.session_interface = TimedSessionInterface()
+
+    # registered before every other hook, so the request timer runs first and its after_request last
+    @app.before_request
+    def start_request_timer(): 
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response): 
+        route = request.endpoint or 'unknown'
+        metrics.inc('game_requests_total', (('route', route), ('status', str(response.status_code))))
+        if 'request_started' in g: 
+            metrics.observe('game_request_seconds', time.perf_counter() - g.request_started, (('route', route),))
+        if 'session_decode_seconds' in g: 
+            metrics.observe('game_phase_seconds', g.session_decode_seconds, (('route', route), ('phase', 'session_decode')))
+        return response
+
 
-app.secret_key = secrets.token_hex()
-
-class Item: 
-    def __init__(self, name, description, restricted, action=None, when_used=None, when_grabbed=None, when_revealed=None, hidden_description=None, environment_effect=None, unlocks=None, used=False): 
-        self.name = name
-        self.description = description
-        self.restricted = restricted
-        self.when_grabbed = when_grabbed
-        # text to be displayed when the item is grabbed
-        self.when_revealed = when_revealed
-        # text to be displayed only for unlocked items
-        self.environment_effect = environment_effect
-        # used {item} to _______
-        self.action = action
-        # how used tells what to unlock when a certain item is used
-        self.unlocks = unlocks if unlocks else []
-        self.hidden_description = hidden_description
-        # makes sure an item cannot be used to unlock already unlocked items
-        self._used = used
-        self.when_used = when_used
-    
-    @property
-    def is_used(self): 
-        return self._used
-    
-    @is_used.setter
-    def is_used(self, value): 
-        if value and not self._used and self.when_used: 
-            if self.when_used == 'driftwood_to_torch': 
-                driftwood_to_torch()
-        self._used = value
-
-    def to_dict(self): 
-        unlocks = [item.to_dict() for item in self.unlocks]
-        return {'name': self.name, 
-                'description': self.description, 
-                'restricted': self.restricted, 
-                'when_revealed': self.when_revealed, 
-                'action': self.action, 
-                'environment_effect': self.environment_effect, 
-                'hidden_description': self.hidden_description, 
-                'unlocks': unlocks, 
-                'when_grabbed': self.when_grabbed, 
-                '_used': self._used, 
-                'when_used': self.when_used}
-
-    @staticmethod
-    def from_dict(data): 
-        unlocks_dicts = data['unlocks']
-        unlocks = [Item.from_dict(unlock) for unlock in unlocks_dicts]
-        return Item(name=data['name'], 
-                    description=data['description'], 
-                    restricted=data['restricted'], 
-                    when_revealed=data['when_revealed'], 
-                    environment_effect=data['environment_effect'], 
-                    action=data['action'], 
-                    when_grabbed=data['when_grabbed'], 
-                    hidden_description=data['hidden_description'], 
-                    unlocks=unlocks, used=data['_used'], 
-                    when_used=data['when_used'])
-
-class MapLocation: 
-    def __init__(self, concealed, revealed, description=None, items=None): 
-        self.concealed = concealed
-        self.revealed = revealed
-        self.items = items if items else []
-        self.description = description
-    
-    def to_dict(self): 
-        items = [item.to_dict() for item in self.items if isinstance(item, Item)]
-        return {'concealed': self.concealed, 
-                'revealed': self.revealed, 
-                'description': self.description, 
-                'items': items}
-
-    @staticmethod
-    def from_dict(data): 
-        item_dicts = data['items']
-        items = [Item.from_dict(item) for item in item_dicts]
-        return MapLocation(concealed=data['concealed'], 
-                           revealed=data['revealed'], 
-                           description=data['description'], 
-                           items=items)
-
-
-key_methods = [
-    "H: display quick rundown of methods", 
-    "M: view map", 
-    "I: view inventory", 
-    "W, A, S, D: North, West, South, East", 
-    "G: grab", 
-    "U: use",
-    "N: inspect (allows you to view the descriptions of all current items in your inventory)"
-]
-                    
-# coords represent coordinates of current location
-def refresh_map(coords): 
-    world_map = session.get('world_map')
-
-    # reveal tiles around new spot (concealed --> revealed)
-    for i in range(coords[0] - 1, coords[0] + 2): 
-        for j in range(coords[1] - 1, coords[1] + 2): 
-            # ensures that the element attempting to be accessed is actually on the grid
-            if i >= 0 and i < 5 and j >= 0 and j < 5: 
-                if isinstance(world_map[i][j], dict): 
-                    world_map[i][j]['concealed'] = world_map[i][j]['revealed']
-    
-    if isinstance(world_map[coords[0]][coords[1]], dict): 
-        world_map[coords[0]][coords[1]]['concealed'] = "@"
-    
-    session['world_map'] = world_map
-    session.modified = True
+# the game rules, the routes below only load the player's state, run an action on it and keep the story
+engine = Engine(world, fragments=fragments, phase=phase)
 
 
 def reset_variables(): 
-    story = ["""Your journey begins...
-    <br><br>
-    <b>Press h for help with commands</b>
-    """]
-
-    items = create_items()
-
-    rooms = create_rooms(items[0], items[1], items[2], items[3], items[4])
-
-    world_map = create_map(rooms[0], rooms[1], rooms[2], rooms[3], rooms[4])
-
-    with app.app_context(): 
-        session['items'] = [items[0].to_dict(), items[1].to_dict(), items[2].to_dict(), items[3].to_dict(), items[4].to_dict()]
-
-        session['inventory'] = []
-
-        story.append(rooms[2]['description'])
-
-        session['story'] = story
-
-        session['rooms'] = rooms
-
-        session['coords'] = [4, 0]
-
-        session['world_map'] = world_map
-
-        session.modified = True
-
-        session['variables_reset'] = True
-
-        return render_template("play.html", story=story)
-
-
-def driftwood_to_torch(): 
-        items = session.get('items')
-        if items: 
-            driftwood=items[4]
-            driftwood['name']="Torch"
-            driftwood['when_grabbed']="You have now created a small torch. "
-            driftwood['description']="A makeshift torch consisting of a small piece of driftwood, lit using a matchbox. "
-            inventory = session.get('inventory')
-            inventory.append(driftwood)
-            session['items'][4] = driftwood
-            first_room_cave=session.get('rooms')[4]
-            first_room_cave['description']="With light from the torch you are able to make out your surroundings. On the opposite end of the cave is a strange altar with an engraving of a flower on top of it. "
-            first_room_cave['items'] = []
-            session['rooms'][4] = first_room_cave
-            session['inventory'] = inventory
-            session['world_map'][3][2] = first_room_cave
-            session.modified = True
-            room_description()
-
-def create_items(): 
-    rose = Item(name="Ageless Rose", 
-                description="A beautiful rose. Feels as though it will never wilt, no matter how long it is stuffed into your pocket", 
-                when_revealed="After entering the gate, the pedestal stands before you. Atop it sits a singular rose in a vase. ", 
-                environment_effect="The rose remains in the vase on the pedestal. ", 
-                hidden_description="Behind the locked gate you are vaguely able to make out the edges of a pedestal with a strange vase resting atop it. ", 
-                when_grabbed="You reach out and gently pick up the rose. Since you don't have a backpack, you pocket it.", 
-                restricted=True)
-    note = Item(name="Mysterious Note", 
-                description="You are amazing <3 ! Thank you so much for playing my game -charlotte (creator)", 
-                when_revealed="Tucked carefully beneath the vase, there appears to be a short note addressed to you.<br>Although the overgrowth around you appears ancient, this note and the rose both appear quite fresh...<br>", 
-                environment_effect="The note addressed to you peeks out from beneath the vase", 
-                when_grabbed="You pick up the letter and gently open it, reading it before pocketing it. ", 
-                restricted=True)
-    key = Item(name="Rusted Key", 
-               description="An ancient, ornate key...maybe it can be used to unlock something?", 
-               action="unlock the garden gate. ", 
-               when_grabbed="After carefully picking it up and brushing off a substantial amount of dirt, you are able to make out the outline of a rusted key", 
-               environment_effect="When you look down at the mossy pathway, you can only barely make out the edges of an old, rusted item. ", 
-               restricted=False, 
-               unlocks=[rose, note])
-
-    driftwood = Item(name="Driftwood", 
-                     description="After lighting the driftwood, you are now mysteriously able to lift it", 
-                     hidden_description="Although you are barely able to make out anything in the pitch-black of the cave, you can see the edge of what appears to be a piece of wood...<br>Mysteriously, you are unable to lift it", 
-                     restricted=True
-                     )
-    
-    matchbox = Item(name="Matchbox", 
-                 description="A mysterious matchbox you found at the cave entrance. I wonder how it got here...", 
-                 action ="light the driftwood. ", 
-                 when_grabbed="After checking around to make sure its owner isn't nearby, you pocket the matchbox. ", 
-                 environment_effect="There appears to be a small matchbox resting atop a small outcropping of boulders. ", 
-                 restricted=False, 
-                 unlocks=[driftwood], 
-                 when_used="driftwood_to_torch", 
-                 )
-
-    return [rose, note, key, matchbox, driftwood]
-
-
-def create_rooms(rose, note, key, matchbox, driftwood): 
-    garden_path = MapLocation(concealed="&nbsp;", 
-                              revealed="&nbsp;", 
-                              description="You see in front of you a mysterious wandering garden pathway lined with all sorts of plants and flowers. ", 
-                              items=[key])
-    secret_garden = MapLocation(concealed="?", 
-                                revealed="&nbsp;", 
-                                description="You find yourself at the center of an ancient, magical garden. Strange palm trees seem to lean towards you as you approach the center. ", 
-                                items=[rose, note])
-    start_location = MapLocation(concealed="@", 
-                                 revealed="&nbsp;", 
-                                 description="You see a garden in front of you, and a gravel path appears to beckon you further in...")
-    cave_entrance = MapLocation(concealed="?", 
-                                revealed="&nbsp;", 
-                                description="In front of you is an ominous, looming cave. Stalactites hang from its foor and it appears to beckon you further inwards...", 
-                                items=[matchbox])
-    first_room_cave = MapLocation(concealed="?", 
-                                  revealed="&nbsp;", 
-                                  description="After entering the cave you are barely able to make out your surroundings. ", 
-                                  items=[driftwood])
-    return [garden_path.to_dict(), secret_garden.to_dict(), start_location.to_dict(), cave_entrance.to_dict(), first_room_cave.to_dict()]
-
-
-def create_map(garden_path, secret_garden, start_location, cave_entrance, first_room_cave): 
-    return [
-            ['?', '?', '?', MapLocation.to_dict(MapLocation(concealed="?", revealed="#")), MapLocation.to_dict(MapLocation(concealed="?", revealed="#"))], 
-            [MapLocation.to_dict(MapLocation(concealed="?", revealed="#")), MapLocation.to_dict(MapLocation(concealed="?", revealed="#")), '?', '?', MapLocation.to_dict(MapLocation(concealed="?", revealed="#"))], 
-            [secret_garden, MapLocation.to_dict(MapLocation(concealed="?", revealed="#")), '?', MapLocation.to_dict(MapLocation(concealed="?", revealed="#")), '?'], 
-            [garden_path, cave_entrance, first_room_cave, MapLocation.to_dict(MapLocation(concealed="?", revealed="#")), '?'], 
-            [start_location, MapLocation.to_dict(MapLocation(concealed="#", revealed="#")), '?', '?', '?']
-        ]
-
-def room_description(): 
-    world_map = session.get('world_map')
-    
-    coords = session.get('coords', [4,0])
-    story = session.get('story', ["""Your journey begins...
-    <br><br>
-    <b>Press h for help with commands</b>
-    """])
-
-    current_room = MapLocation.from_dict(world_map[coords[0]][coords[1]])
-
-    story.append(current_room.description)
-
-    if current_room.items: 
-        for item in current_room.items: 
-            if not item.restricted and item.environment_effect: 
-                story.append(item.environment_effect)
-            elif item.restricted and item.hidden_description: 
-                story.append(item.hidden_description)
-
-    session['story'] = story
+    player_state, story = engine.new_game()
+    # filled in place, asgi.py holds on to the same dict
+    state.clear()
+    state.update(player_state)
+
+    state['story'] = story
+
+    state['seq'] = len(story)
+
+    # seq of the first line this game has, earlier lines belonged to a game that was replaced by a restored save
+    state['story_base'] = 0
+
+    # changes whenever a new story starts (a new game, a restored save or a rebuilt game),
+    # with seq it says which version of the page /play would render
+    state['story_id'] = secrets.token_hex(4)
+
+    state['variables_reset'] = True
+
+    # a new game starts a new story log and action log
+    g.pop('story_lines', None)
+    story_log.delete(g.user_id)
+    event_log.delete(g.user_id)
+
+
+def rebuild_game(): 
+    # a player with an action log but no state (e.g. the server restarted with the memory store) gets their game back:
+    # the latest snapshot with the actions logged after it replayed on top, returns False if there is nothing to rebuild
+    try: 
+        latest = event_log.latest_snapshot(g.user_id)
+        names = event_log.read(g.user_id, latest[0] if latest else 0)
+        saved = decode_snapshot(latest[1], world) if latest else None
+    except ValueError: 
+        # a damaged log, or one taken in another version of the world: the game can't be continued
+        return False
+    if latest is None and not names: 
+        return False
+    player_state, seq = replay(engine, names, saved)
+    lines = []
+    engine.room_description(player_state, lines)
+    # filled in place, asgi.py holds on to the same dict
+    state.clear()
+    state.update(player_state)
+    # like a restored save, the rebuilt game starts a new story from where the old one was
+    g.pop('story_lines', None)
+    story_log.delete(g.user_id)
+    story = ["Game rebuilt from your action log."] + lines
+    state.update(story=story, seq=seq + len(story), story_base=seq, story_id=secrets.token_hex(4), variables_reset=True)
+    return True
+
+
+def start_game(): 
+    if not rebuild_game(): 
+        reset_variables()
+
+
+def log_story(): 
+    # appends the lines moved out of the story buffer since the last call to the player's story log
+    # (they are only written with the state, so a batch that is rolled back leaves the log as it was)
+    lines = g.pop('story_lines', None)
+    if lines: 
+        story_log.append(g.user_id, lines)
+
+
+def log_events(): 
+    # appends the actions run since the last call to the player's action log, taking a snapshot whenever
+    # the log passes a multiple of EVENT_SNAPSHOT_EVERY
+    names = g.pop('events', None)
+    if not names: 
+        return
+    count = event_log.append(g.user_id, names)
+    every = app.config['EVENT_SNAPSHOT_EVERY']
+    if count // every != (count - len(names)) // every: 
+        event_log.add_snapshot(g.user_id, count, encode_snapshot(g.state, world))
+
+
+@app.before_request
+def start_profiler(): 
+    global profiler_autostart
+    if profiler_autostart: 
+        profiler_autostart = False
+        profiler.start()
+
 
 @app.before_request
 def assign_user_id(): 
+    # static files don't touch the session, so they go out without a Set-Cookie or Vary: Cookie and can be cached
+    # neither do urls that match no route (a browser's /favicon.ico, bots trying urls), they are only ever a 404
+    if request.endpoint == 'static' or request.endpoint is None: 
+        return
     if 'user_id' not in session: 
         session['user_id'] = str(uuid.uuid4())
 
+
+@app.before_request
+def load_state(): 
+    if request.endpoint in STATELESS_ENDPOINTS or request.endpoint is None: 
+        return
+    g.user_id = session['user_id']
+    g.player_lock = player_lock(g.user_id)
+    g.player_lock.acquire()
+    with phase('state_load'): 
+        live = live_games.get(g.user_id)
+        g.state = live[0] if live else unpack_state(store.load(g.user_id))
+    # a new player, or one whose state was lost (a restart with the memory store, a state evicted or from an
+    # older version), gets their game rebuilt from the action log (or a new one) before a route plays on it
+    if request.endpoint in PLAYING_ENDPOINTS and not g.state.get('variables_reset'): 
+        start_game()
+
+
+@app.after_request
+def save_state(response): 
+    # a request that didn't play (e.g. /history of a player with no game yet) has no game to save
+    if 'state' in g and g.state.get('variables_reset'): 
+        with phase('story_log'): 
+            log_story()
+        with phase('event_log'): 
+            log_events()
+        packed = pack_state(g.state)
+        with phase('state_save'): 
+            store.save(g.user_id, packed)
+        if metrics.enabled: 
+            metrics.observe('game_state_bytes', len(encode_state(packed)))
+            metrics.observe('game_story_lines', len(g.state.get('story') or []))
+    return response
+
+
+@app.teardown_request
+def release_player(exception=None): 
+    # after save_state(), and also when the request failed
+    lock = g.pop('player_lock', None)
+    if lock is not None: 
+        lock.release()
+
+
 @app.route('/')
-def welcome():
-    return render_template("welcome.html")
+def welcome(): 
+    response = app.make_response(render_template("welcome.html"))
+    # the same for everyone until the next deploy, so the tag is the page's own hash
+    response.add_etag()
+    matched = etag_matches(request, response.get_etag()[0])
+    if matched: 
+        return not_modified(matched, 'no-cache')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/play')
 def play(): 
-    while not session.get('variables_reset'): 
-        reset_variables()
-    story = session.get('story')
-    return render_template("play.html", story=story)
-
+    while not state.get('variables_reset'): 
+        start_game()
+    story = state.get('story')
+    seq = state.get('seq', len(story))
+    # the page only changes when the story does, so a reload of an unchanged game is answered with a 304
+    # before anything is rendered (private: the page is one player's game, no-cache: always ask first)
+    etag = f"{page_version()}-{state.get('story_id', '')}-{seq}"
+    matched = etag_matches(request, etag)
+    if matched: 
+        return not_modified(matched, 'private, no-cache')
+    with phase('template_render'): 
+        response = app.make_response(render_template("play.html", story=story, seq=seq, first_seq=seq - len(story), story_base=state.get('story_base', 0), max_batch=MAX_BATCH))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@lru_cache(maxsize=None)
+def page_version(): 
+    # changes with anything a deploy can change about the play page: the templates, the static files it links to,
+    # the world and the batch size
+    digest = hashlib.sha1(f"{world.version}-{MAX_BATCH}".encode())
+    for template in ('layout.html', 'play.html'): 
+        digest.update(file_hash(os.path.join(app.root_path, app.template_folder, template)).encode())
+    for name in sorted(os.listdir(app.static_folder)): 
+        digest.update((static_version(name) or '').encode())
+    return digest.hexdigest()[:12]
+
+
+@lru_cache(maxsize=256)
+def static_version(filename): 
+    # the hash of a static file, added to its url as ?v= so the url changes whenever the file does
+    path = safe_join(app.static_folder, filename)
+    return file_hash(path) if path and os.path.isfile(path) else None
+
+
+@app.url_defaults
+def version_static_urls(endpoint, values): 
+    if endpoint == 'static' and 'filename' in values: 
+        version = static_version(values['filename'])
+        if version: 
+            values.setdefault('v', version)
+
+
+@app.after_request
+def cache_headers(response): 
+    # static files are tagged with the hash of their contents, which is the same on every server
+    # a url with the file's current hash never changes, so it can be kept for a year without asking again,
+    # without one (or with an old hash) the browser checks back with the tag
+    if request.endpoint == 'static' and response.status_code == 200: 
+        version = static_version(request.view_args.get('filename', ''))
+        if version: 
+            response.set_etag(version)
+            response.make_conditional(request)
+        if version and request.args.get('v') == version: 
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else: 
+            response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.after_request
+def compress(response): 
+    if app.config['COMPRESS_MIN_SIZE'] > 0: 
+        with phase('compress'): 
+            compress_response(response, request.accept_encodings, app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_LEVEL'])
+    return response
+
+
+def run_action(name): 
+    # runs one action on the loaded state, adds the lines it produced to the story and sends them back
+    if name == 'clear': 
+        story = state['story']
+        # cleared lines stay reachable through /history
+        g.setdefault('story_lines', []).extend(story)
+        story.clear()
+        result = story_update(["Workspace cleared."], cleared=True)
+    else: 
+        result = story_update(engine.step(g.state, name)[1])
+    g.setdefault('events', []).append(name)
+    return result
 
-# routes from key presses (will be reused throughout story)
-@app.route('/display_map')
-def display_map(): 
-    story = session.get('story')
-    world_map = session.get('world_map')
-    this_row = ""
 
-    map_display = ""
+def story_update(lines, cleared=False): 
+    # sends back (as json) only the lines added by this action instead of the whole story,
+    # seq is the total number of lines ever added so the page can tell if it missed any
+    story = state['story']
+    story.extend(lines)
+    state['seq'] = state.get('seq', 0) + len(lines)
+    trim_story(story)
+    return {'seq': state['seq'], 'lines': lines, 'clear': cleared}
 
-    for row in world_map: 
-        for cell in row: 
-            if isinstance(cell, dict): 
-                this_row += cell['concealed'] + "&nbsp;&nbsp;"
-            else: 
-                this_row += cell + "&nbsp;&nbsp;"
-        map_display += this_row + "<br>"
-        this_row = ""
-    
-    map_display += "key: <br>@: current location<br>?: not yet discovered<br>#: wall<br>&nbsp;: open area/able to go through"
 
-    story.append(map_display)
+def trim_story(story): 
+    overflow = len(story) - app.config['STORY_BUFFER_SIZE']
+    if overflow > 0: 
+        g.setdefault('story_lines', []).extend(story[:overflow])
+        del story[:overflow]
 
-    session['story'] = story
 
-    session.modified = True
+@app.route('/history')
+def history(): 
+    # pages of older story, ?before=N returns up to limit lines that came before line N
+    story = state.get('story') or []
+    seq = state.get('seq', len(story))
+    first_seq = seq - len(story)
+    # the story log starts at story_base (see restore())
+    base = state.get('story_base', 0)
+    before = max(min(request.args.get('before', first_seq, type=int), seq), base)
+    limit = max(min(request.args.get('limit', 50, type=int), 200), 1)
+    start = max(before - limit, base)
 
-    return render_template("play.html", story=story)
+    lines = story_log.read(g.user_id, start - base, min(before, first_seq) - base)
+    lines += story[max(start - first_seq, 0):max(before - first_seq, 0)]
 
+    return jsonify(start=start, before=before, lines=lines)
 
-@app.route('/display_inventory')
-def display_inventory(): 
-    inventory = session.get('inventory', [])
-    story = session.get('story')
 
-    if len(inventory) == 0: 
-        story.append("Inventory is empty")
-    else: 
-        inventory_display = "Inventory: <br><ul>"
-        for item in inventory: 
-            if isinstance(item, dict): 
-                this_item = Item.from_dict(item)
-                inventory_display += f"<li>{this_item.name}</li>"
-        inventory_display += "</ul>"
-        story.append(inventory_display)
-    
-    session['story'] = story
+@app.route('/map')
+def display_map(): 
+    # the map is shown in its own panel on the page, it isn't added to the story
+    return engine.map_view(g.state, app.config['MAP_VIEW_RADIUS'])
 
-    session.modified = True
 
-    return render_template("play.html", story=story)
+# routes from key presses (will be reused throughout story)
+@app.route('/display_inventory')
+def display_inventory(): 
+    return run_action('display_inventory')
 
 
 @app.route('/help')
 def help(): 
-    story = session.get('story')
-
-    for method in key_methods: 
-        story.append(method + "<br>")
-
-    session['story'] = story
-
-    session.modified = True
-
-    return render_template("play.html", story=story)
-
-
-def move(hv): 
-    coords = session.get('coords', [4, 0])
-    story = session.get('story')
-    world_map = session.get('world_map')
-    
-    new_coords = [coords[0], coords[1]]
-
-    if hv == "N": 
-        new_coords[0] -= 1
-    elif hv == "S": 
-        new_coords[0] += 1
-    elif hv == "W": 
-        new_coords[1] -= 1
-    elif hv == "E": 
-        new_coords[1] += 1
-    
-    if not (0 <= new_coords[0] < 5 and 0 <= new_coords[1] < 5): 
-        story.append(f'You cannot move {hv} (out of map scope)')
-        session['story'] = story
-        session.modified = True
-        return render_template("play.html", story=story)
-    
-    new_location = world_map[new_coords[0]][new_coords[1]]
-
-    if not isinstance(new_location, dict): 
-        story.append("This part of the map has not yet been developed...wait for future releases to explore here!")
-        session['story'] = story
-        session.modified = True
-        return render_template("play.html", story=story)
-
-    if new_location['revealed'] == "#": 
-        story.append(f"You cannot move {hv} (blocked by wall: #)")
-        session['story'] = story
-        session.modified = True
-        return render_template("play.html", story=story)
-    
-    session['coords'] = new_coords
-    session.modified = True
-    world_map[new_coords[0]][new_coords[1]]['concealed'] = "@"
-    session['world_map'] = world_map
-    session['story'] = story
-    
-    session.modified = True
-
-    room_description()
-
-    refresh_map(new_coords)
-
-    return render_template("play.html", story=story)
+    return run_action('help')
 
 
 @app.route('/north')
 def north(): 
-    return move("N")
+    return run_action('north')
 
 
 @app.route('/west')
 def west(): 
-    return move("W")
+    return run_action('west')
 
 
 @app.route('/south')
 def south(): 
-    return move("S")
+    return run_action('south')
 
 
 @app.route('/east')
 def east(): 
-    return move("E")
+    return run_action('east')
 
 
 @app.route('/grab')
 def grab(): 
-    coords = session.get('coords')
-    world_map = session.get('world_map')
-    story = session.get('story')
-    inventory = session.get('inventory')
-
-    current_location = MapLocation.from_dict(world_map[coords[0]][coords[1]])
-
-    if not current_location.items: 
-        story.append("There is nothing to grab here.")
-        session['story'] = story
-        return render_template("play.html", story=story)
-    
-    # items detected
-    nothing_added = True
-
-    for item in current_location.items: 
-        if not item.restricted and item.to_dict() not in inventory: 
-            if isinstance(item, Item): 
-                inventory.append(item.to_dict())
-                current_location.items.remove(item)
-            if item.when_grabbed: 
-                story.append(item.when_grabbed)
-            story.append(f"Added to inventory: {item.name}: {item.description}<br>")
-            nothing_added = False
-    
-
-    if nothing_added: 
-        story.append("There is nothing you can grab here at the moment")
-    
-    world_map[coords[0]][coords[1]] = current_location.to_dict()
-
-    session['world_map'] = world_map
-    session['story'] = story
-    session['inventory'] = inventory
-
-    session.modified = True
-
-    return render_template("play.html", story=story)
+    return run_action('grab')
 
 
 @app.route('/use')
 def use(): 
-    coords = session.get('coords')
-    inventory = session.get('inventory')
-    story = session.get('story')
-    world_map = session.get('world_map')
-
-    current_location = MapLocation.from_dict(world_map[coords[0]][coords[1]])
-
-    # I bet that this could be done more efficiently but I don't really want to rn :)
-    already_used = False
-
-    for item in inventory: 
-
-        for unlock in item['unlocks']: 
-
-            for i in range(len(current_location.items)): 
-
-                if current_location.items[i].to_dict() == unlock: 
-                    if not already_used and not item['_used']: 
-                        story.append(f"Successfully used {item['name']} to {item['action']}")
-                        already_used = True
-                    item = Item.from_dict(item)
-                    item.is_used = True
-                    if item.when_used: 
-                        inventory=session.get('inventory')
-                        story=session.get('story')
-                        world_map=session.get('world_map')
-                        current_location = MapLocation.from_dict(world_map[coords[0]][coords[1]])
-                    if current_location.items and i < len(current_location.items): 
-                        if isinstance(current_location.items[i], Item): 
-                            current_location.items[i].restricted = False
-                            if current_location.items[i].when_revealed: 
-                                story.append(current_location.items[i].when_revealed)
-                    world_map[coords[0]][coords[1]] = current_location.to_dict()
-
-    if not already_used: 
-        story.append("You cannot use that item here")
-    
-    session['world_map'] = world_map
-    session['story'] = story
-
-    session.modified = True
-
-    return render_template("play.html", story=story)
+    return run_action('use')
 
 
 @app.route('/inspect')
 def inspect(): 
-    inventory = session.get('inventory')
-    story = session.get('story')
-
-    if len(inventory) == 0: 
-        story.append("You do not have any items in your inventory")
-        session['story'] = story
-        session.modified = True
-        return render_template("play.html", story=story)
-    
-    text = ""
-    text += "Here are your items: <br>"
-    for item in inventory: 
-        text += f"&nbsp;&nbsp;{item['name']}: {item['description']}<br>"
-    
-    story.append(text)
-
-    session['story'] = story
-
-    session.modified = True
-
-    return render_template("play.html", story=story)
+    return run_action('inspect')
 
 
 @app.route('/clear')
 def clear(): 
-    story = session['story']
-    story.clear()
-    story.append("Workspace cleared.")
-    session['story'] = story
-
-    session.modified = True
-
-    return render_template("play.html", story=story)
-
-
-if __name__ == '__main__':
+    return run_action('clear')
+
+
+def save_file(): 
+    while not state.get('variables_reset'): 
+        start_game()
+    return encode_snapshot(state, world)
+
+
+@app.route('/save')
+def save(): 
+    # the player's progress as a small save file (see snapshot.py), restored through /restore
+    return save_file(), 200, {
+        'Content-Type': 'application/octet-stream', 
+        'Content-Disposition': 'attachment; filename="text-adventure.save"', 
+    }
+
+
+def restore_game(data): 
+    # replaces the player's game with a save file, raises ValueError if it isn't a save of this world
+    saved = decode_snapshot(data, world)
+    seq = saved.pop('seq')
+    # the story itself isn't saved, the restored game starts a new one from where the saved one was
+    g.pop('story_lines', None)
+    story_log.delete(g.user_id)
+    player_state, lines = engine.resume(saved)
+    # filled in place, asgi.py holds on to the same dict
+    state.clear()
+    state.update(player_state)
+    story = ["Saved game restored."] + lines
+    state.update(story=story, seq=seq + len(story), story_base=seq, story_id=secrets.token_hex(4), variables_reset=True)
+    g.pop('events', None)
+    event_log.restart(g.user_id, encode_snapshot(g.state, world))
+
+
+@app.route('/restore', methods=['POST'])
+def restore(): 
+    # takes a save file from /save, either as the request body or as the "save" field of a form upload
+    # one byte more than a save file can have is read, to tell a file that is too big from one that fits
+    upload = request.files.get('save')
+    data = upload.read(MAX_SNAPSHOT_SIZE + 1) if upload else request.stream.read(MAX_SNAPSHOT_SIZE + 1)
+    if len(data) > MAX_SNAPSHOT_SIZE: 
+        return {'error': "Save file is too big"}, 413
+    try: 
+        restore_game(data)
+    except ValueError as e: 
+        return {'error': str(e)}, 400
+    return {'restored': True}
+
+
+def local_only(): 
+    # /metrics and /profile are for whoever runs the server, not for players
+    return request.remote_addr in ('127.0.0.1', '::1') or os.environ.get('METRICS_ALLOW_REMOTE') == '1'
+
+
+@app.route('/metrics', endpoint='metrics')
+def metrics_endpoint(): 
+    if not metrics.enabled or not local_only(): 
+        return "Not found", 404
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/profile', methods=['GET', 'POST'])
+def profile(): 
+    # GET: the profiler's samples as collapsed stacks
+    # POST ?enabled=1 / ?enabled=0: start or stop sampling, ?reset=1 drops what has been collected so far
+    if not local_only(): 
+        return "Not found", 404
+    if request.method == 'POST': 
+        if request.args.get('reset') == '1': 
+            profiler.reset()
+        if request.args.get('enabled') == '1': 
+            profiler.start()
+        elif request.args.get('enabled') == '0': 
+            profiler.stop()
+        return {'running': profiler.running}
+    return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+def warm_up(): 
+    # does everything the first request would otherwise pay for: loading the templates (from the template cache
+    # if they are in it), rendering both pages and playing a throwaway game, which fills the fragment cache
+    # and the engine's caches for the start of the world
+    if startup['warmed'] is not None: 
+        return
+    with app.test_request_context('/'): 
+        player_state, story = engine.new_game()
+        engine.step(player_state, 'help')
+        engine.map_view(player_state, app.config['MAP_VIEW_RADIUS'])
+        render_template("welcome.html")
+        render_template("play.html", story=story, seq=len(story), first_seq=0, story_base=0, max_batch=MAX_BATCH)
+    page_version()
+    startup['warmed'] = round(time.perf_counter() - STARTED, 4)
+
+
+def create_app(): 
+    # used by wsgi.py: everything workers can share is set up here, so with gunicorn's preload_app
+    # it happens once in the master process and the workers get it through fork
+    # (the world is already built at import, this warms up everything else)
+    warm_up()
+    return app
+
+
+@app.route('/ready')
+def ready(): 
+    # readiness check for the host: answers once the app has warmed up, warming it up first if nothing has yet
+    warm_up()
+    return {'ready': True, 'startup_seconds': startup}
+
+
+@app.after_request
+def record_first_response(response): 
+    if startup['first_response'] is None: 
+        startup['first_response'] = round(time.perf_counter() - STARTED, 4)
+        print(f"first response sent {startup['first_response']:.3f}s after startup (app imported in {startup['imported']:.3f}s)", file=sys.stderr, flush=True)
+    return response
+
+
+# every action a player can take, by name (the routes above and the websocket in asgi.py use the same names)
+# clear only empties the story, so it is handled here rather than by the engine
+ACTIONS = Engine.ACTIONS + ('clear',)
+
+# every action is written to the action log as its code in event_log.EVENTS, an action without one would only fail
+# in save_state(), after it had been played, so an action added to the engine has to be added there as well
+unlogged = [name for name in ACTIONS if name not in EVENT_CODES]
+if unlogged: 
+    raise RuntimeError(f"Actions without a code in event_log.EVENTS: {', '.join(unlogged)}")
+
+# routes that play on the player's game, each action has a route of the same name
+# (/history and /restore don't: one only reads the story there is, the other replaces the game)
+PLAYING_ENDPOINTS = ACTIONS + ('play', 'actions', 'display_map', 'save')
+
+
+# the most actions one batch can hold
+MAX_BATCH = 50
+
+
+def apply_actions(names): 
+    # runs the actions one after another on the loaded state and merges their story updates into one
+    update = {'seq': state.get('seq', 0), 'lines': [], 'clear': False}
+    for name in names: 
+        result = run_action(name)
+        if result['clear']: 
+            # anything before a clear is gone from the page anyway
+            update['lines'] = []
+            update['clear'] = True
+        update['lines'] += result['lines']
+        update['seq'] = result['seq']
+    return update
+
+
+@app.route('/actions', methods=['POST'])
+def actions(): 
+    # applies an ordered batch of actions ({"actions": ["north", "grab", ...]}) with one state load and one save
+    # the batch is all or nothing: if any action fails the saved state is left as it was
+    names = (request.get_json(silent=True) or {}).get('actions')
+    if not isinstance(names, list) or not 0 < len(names) <= MAX_BATCH or any(name not in ACTIONS for name in names): 
+        return {'error': f"Expected a list of 1 to {MAX_BATCH} actions from: {', '.join(ACTIONS)}"}, 400
+    before = copy.deepcopy(g.state)
+    try: 
+        return apply_actions(names)
+    except Exception: 
+        # put back in place, an open websocket may be holding the same dict
+        g.state.clear()
+        g.state.update(before)
+        g.pop('story_lines', None)
+        g.pop('events', None)
+        raise
+
+
+def open_game(user_id): 
+    # the state a websocket that is opening plays on (used by asgi.py), the same one as any other socket
+    # the player has open, and the one their HTTP requests play on until the last socket closes
+    with player_lock(user_id): 
+        live = live_games.get(user_id)
+        if live is None: 
+            live = live_games[user_id] = [unpack_state(store.load(user_id)), 0]
+        live[1] += 1
+        return live[0]
+
+
+def save_game(user_id, player_state): 
+    # pack_state() makes a copy, so the state in memory keeps its sets
+    with player_lock(user_id): 
+        store.save(user_id, pack_state(player_state))
+
+
+def close_game(user_id, player_state, unsaved): 
+    # a websocket closed, saving what it played since its last save
+    with player_lock(user_id): 
+        if unsaved: 
+            store.save(user_id, pack_state(player_state))
+        live = live_games[user_id]
+        live[1] -= 1
+        if not live[1]: 
+            del live_games[user_id]
+
+
+def run_actions(player_state, user_id, names): 
+    # runs actions on a state that is already loaded, outside of any HTTP request (used by asgi.py)
+    # returns the same story update /actions would have sent back
+    with player_lock(user_id), app.app_context(): 
+        g.state = player_state
+        g.user_id = user_id
+        if not player_state.get('variables_reset'): 
+            start_game()
+        update = apply_actions(names)
+        log_story()
+        log_events()
+        return update
+
+
+def run_restore(player_state, user_id, data): 
+    # restore_game() on a state that is already loaded, outside of an HTTP request (used by asgi.py)
+    # the restored game replaces player_state in place and is saved straight away
+    with player_lock(user_id), app.app_context(): 
+        g.state = player_state
+        g.user_id = user_id
+        restore_game(data)
+        store.save(user_id, pack_state(player_state))
+
+
+def run_save(player_state, user_id): 
+    # save_file() on a state that is already loaded, outside of an HTTP request (used by asgi.py)
+    with player_lock(user_id), app.app_context(): 
+        g.state = player_state
+        g.user_id = user_id
+        return save_file()
+
+
+def render_map(player_state, user_id): 
+    # the map of a state that is already loaded, outside of an HTTP request (used by asgi.py)
+    with player_lock(user_id), app.app_context(): 
+        g.state = player_state
+        g.user_id = user_id
+        if not player_state.get('variables_reset'): 
+            start_game()
+        return engine.map_view(player_state, app.config['MAP_VIEW_RADIUS'])
+
+
+startup['imported'] = round(time.perf_counter() - STARTED, 4)
+
+
+if __name__ == '__main__': 
+    if sys.argv[1:] == ['--prepare']: 
+        # build step for hosts that start every instance from a fresh copy of the build (e.g. Render waking up):
+        # importing the app writes the world pack, warming up writes the compiled templates, so neither is redone
+        warm_up()
+        print(f"prepared in {startup['warmed']:.3f}s")
+        sys.exit()
+    warm_up()
     # chatgpt code to get render (web application publishing service) to display my webpage by fixing the port number
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,144 @@
+# ASGI entry point: the Flask app for every normal page plus a websocket for playing
+# run with any ASGI server, e.g. "uvicorn asgi:application"
+#
+# /ws: the page sends one action name ("north", "grab", ..., or "map") or a json list of action names
+# per message and gets back the same json the HTTP route or /actions would have answered with, in the same order
+# a binary message is a save file (see snapshot.py) that replaces the game, like POST /restore,
+# and "save" gets the game's save file back as a binary message, like GET /save
+# the player's state is loaded once when the socket opens and stays in memory while it is open,
+# it is saved every WEBSOCKET_SAVE_EVERY actions and when the socket closes
+# HTTP requests the player makes meanwhile (/history, /map, /save, ...) play on the same state (see open_game())
+# the game runs in a worker thread, so file writes and the store don't hold up the event loop
+
+import asyncio
+import json
+import os
+from http.cookies import SimpleCookie
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from itsdangerous import BadSignature
+
+from app import app, open_game, save_game, close_game, run_actions, run_restore, run_save, render_map, warm_up, ACTIONS, MAX_BATCH
+from snapshot import MAX_SNAPSHOT_SIZE
+
+
+class PooledWsgiToAsgiInstance(WsgiToAsgiInstance): 
+    # asgiref runs every WSGI request on one shared thread (sync_to_async is thread sensitive by default),
+    # so one request waiting (e.g. on a player lock a websocket action holds) would hold up every other one
+    # here each request runs on a thread of the event loop's default thread pool instead
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi): 
+    async def __call__(self, scope, receive, send): 
+        await PooledWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+http_application = PooledWsgiToAsgi(app)
+
+SAVE_EVERY = int(os.environ.get('WEBSOCKET_SAVE_EVERY', 20))
+
+
+def session_user_id(scope): 
+    # reads the user_id out of the same signed session cookie Flask uses
+    cookie = SimpleCookie()
+    for name, value in scope['headers']: 
+        if name == b'cookie': 
+            cookie.load(value.decode('latin-1'))
+    morsel = cookie.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None: 
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    try: 
+        data = serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature: 
+        return None
+    return data.get('user_id')
+
+
+def parse_actions(message): 
+    # "north" or '["north", "grab"]' -> list of action names, None if anything in it isn't an action
+    if message.startswith('['): 
+        try: 
+            names = json.loads(message)
+        except ValueError: 
+            return None
+    else: 
+        names = [message]
+    if not isinstance(names, list) or not 0 < len(names) <= MAX_BATCH or any(name not in ACTIONS for name in names): 
+        return None
+    return names
+
+
+async def game_socket(scope, receive, send): 
+    await receive()
+    user_id = session_user_id(scope)
+    if user_id is None: 
+        # the page has to be loaded over HTTP first to get a session
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    player_state = await asyncio.to_thread(open_game, user_id)
+    await send({'type': 'websocket.accept'})
+
+    unsaved = 0
+    try: 
+        while True: 
+            event = await receive()
+            if event['type'] == 'websocket.disconnect': 
+                break
+            if event.get('bytes'): 
+                # saved straight away, the game this socket held before is gone
+                try: 
+                    if len(event['bytes']) > MAX_SNAPSHOT_SIZE: 
+                        raise ValueError("Save file is too big")
+                    await asyncio.to_thread(run_restore, player_state, user_id, event['bytes'])
+                except ValueError as e: 
+                    reply = {'error': str(e)}
+                else: 
+                    unsaved = 0
+                    reply = {'restored': True}
+                await send({'type': 'websocket.send', 'text': json.dumps(reply)})
+                continue
+            message = (event.get('text') or '').strip()
+            if message == 'save': 
+                data = await asyncio.to_thread(run_save, player_state, user_id)
+                await send({'type': 'websocket.send', 'bytes': data})
+                continue
+            names = parse_actions(message)
+            if message == 'map': 
+                reply = {'map': await asyncio.to_thread(render_map, player_state, user_id)}
+            elif names: 
+                reply = await asyncio.to_thread(run_actions, player_state, user_id, names)
+                unsaved += len(names)
+            else: 
+                reply = {'error': f"Unknown action: {message}"}
+            await send({'type': 'websocket.send', 'text': json.dumps(reply)})
+            if unsaved >= SAVE_EVERY: 
+                await asyncio.to_thread(save_game, user_id, player_state)
+                unsaved = 0
+    finally: 
+        await asyncio.to_thread(close_game, user_id, player_state, unsaved)
+
+
+async def lifespan(receive, send): 
+    while True: 
+        event = await receive()
+        if event['type'] == 'lifespan.startup': 
+            # the server only starts taking requests once this is done
+            await asyncio.to_thread(warm_up)
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown': 
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send): 
+    if scope['type'] == 'websocket' and scope['path'] == '/ws': 
+        await game_socket(scope, receive, send)
+    elif scope['type'] == 'websocket': 
+        await send({'type': 'websocket.close', 'code': 4404})
+    elif scope['type'] == 'lifespan': 
+        await lifespan(receive, send)
+    else: 
+        await http_application(scope, receive, send)
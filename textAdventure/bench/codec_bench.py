@@ -0,0 +1,73 @@
+# micro-benchmark: item/location codecs
+# compares the dict round-trip the game used to do on every grab/use/room_description
+# (nested to_dict() with full copies of unlocked items, through json like the session cookie)
+# against the id based tuple codec in world.py
+# run from the textAdventure directory: python bench/codec_bench.py
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from world import Item, MapLocation, build_world, encode, decode_items, decode_locations
+
+world = build_world()
+items = list(world.items)
+locations = [tile for _, _, tile in world.grid.tiles()]
+
+
+def legacy_item_dict(item): 
+    # the old to_dict(): unlocks were embedded as full item dicts
+    data = item.to_dict()
+    data['unlocks'] = [legacy_item_dict(world.items[unlock_id]) for unlock_id in item.unlocks]
+    return data
+
+
+def legacy_item(data): 
+    unlocks = [legacy_item(unlock) for unlock in data['unlocks']]
+    item = Item.from_dict(dict(data, unlocks=[]))
+    item.unlocks = tuple(unlocks)
+    return item
+
+
+def legacy_location_dict(location): 
+    data = location.to_dict()
+    data['items'] = [legacy_item_dict(world.items[item_id]) for item_id in location.items]
+    return data
+
+
+def legacy_location(data): 
+    location = MapLocation.from_dict(dict(data, items=[]))
+    location.items = tuple(legacy_item(item) for item in data['items'])
+    return location
+
+
+def dict_round_trip(): 
+    data = json.dumps([legacy_item_dict(item) for item in items] + [legacy_location_dict(location) for location in locations])
+    decoded = json.loads(data)
+    [legacy_item(item) for item in decoded[:len(items)]]
+    [legacy_location(location) for location in decoded[len(items):]]
+    return len(data)
+
+
+def tuple_round_trip(): 
+    item_data = encode(items)
+    location_data = encode(locations)
+    decode_items(item_data)
+    decode_locations(location_data)
+    return len(item_data) + len(location_data)
+
+
+def run(name, func, number): 
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{name:<20} {seconds / number * 1e6:10.2f} us/round-trip {func():8d} bytes")
+    return seconds
+
+
+if __name__ == '__main__': 
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    legacy = run("dict + json", dict_round_trip, number)
+    compact = run("tuple + marshal", tuple_round_trip, number)
+    print(f"speedup: {legacy / compact:.1f}x")
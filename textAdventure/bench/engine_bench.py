@@ -0,0 +1,37 @@
+# engine throughput: games played straight through engine.Engine, with no Flask, store or story in the way
+# shows how many actions per second one process can simulate, the ceiling for anything built on the engine
+# run from the textAdventure directory: python bench/engine_bench.py [games]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import Engine
+from world import build_world
+
+# start -> garden path -> secret garden with the key, then back past the cave entrance to light the torch
+PLAYTHROUGH = ('north', 'grab', 'north', 'use', 'grab', 'south', 'east', 'grab', 'east', 'use', 'grab', 'inspect', 'display_inventory', 'help')
+
+
+def play(engine, games): 
+    lines = 0
+    for _ in range(games): 
+        player_state, _ = engine.new_game()
+        for action in PLAYTHROUGH: 
+            lines += len(engine.step(player_state, action)[1])
+    return lines
+
+
+if __name__ == '__main__': 
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    engine = Engine(build_world())
+    # one game first so the fragment cache is warm, like on a server that has been running for a while
+    play(engine, 1)
+    start = time.perf_counter()
+    lines = play(engine, games)
+    seconds = time.perf_counter() - start
+    actions = games * len(PLAYTHROUGH)
+    print(f"{games} games, {actions} actions, {lines} lines of story in {seconds:.2f}s")
+    print(f"{actions / seconds:,.0f} actions/s, {games / seconds:,.0f} games/s")
@@ -0,0 +1,175 @@
+# load test: simulated players walking scripted routes through the real routes in app.py
+# every player has their own test client (so their own session cookie) and the players take turns, one action each,
+# so all of their games are live in the state store at the same time like on a busy server
+# with --processes the players are split over several worker processes, each with its own copy of the app
+# run from the textAdventure directory: python bench/load_test.py [--players 2000] [--processes 4] [--route garden] [--json]
+# keep the report of a run from before a change to app.py and compare it with one from after
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# each step is an action and the text its reply has to contain, so a route that stops working fails loudly
+ROUTES = {
+    # start -> garden path -> secret garden, where the key unlocks the rose and the note
+    'garden': [
+        ('north', 'garden pathway'),
+        ('grab', 'Added to inventory: Rusted Key'),
+        ('north', 'magical garden'),
+        ('use', 'Successfully used Rusted Key'),
+        # both unlocked items are on the same tile and have to come out of a single grab
+        ('grab', ('Added to inventory: Ageless Rose', 'Added to inventory: Mysterious Note')),
+        ('display_inventory', 'Mysterious Note'),
+        ('map', '@'),
+    ],
+    # start -> cave entrance -> first room of the cave, where the matchbox turns the driftwood into a torch
+    'cave': [
+        ('north', 'garden pathway'),
+        ('east', 'looming cave'),
+        ('grab', 'Added to inventory: Matchbox'),
+        ('east', 'piece of wood'),
+        ('use', ('Successfully used Matchbox', 'light from the torch')),
+        ('inspect', 'Torch'),
+        ('map', '@'),
+    ],
+}
+
+
+def rss(): 
+    # resident memory of this process in bytes
+    try: 
+        with open('/proc/self/statm') as f: 
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError: 
+        # outside linux only the peak is available (in bytes on macos, kB elsewhere)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def timed_request(client, action, expected): 
+    # returns how long the request took in seconds
+    start = time.perf_counter()
+    response = client.get('/' + action)
+    elapsed = time.perf_counter() - start
+    body = response.get_data(as_text=True)
+    if response.status_code != 200: 
+        raise AssertionError(f"/{action} returned {response.status_code}: {body[:200]!r}")
+    for text in (expected,) if isinstance(expected, str) else expected: 
+        if text not in body: 
+            raise AssertionError(f"/{action}: expected {text!r} in the reply, got {body[:200]!r}")
+    return elapsed
+
+
+def run_players(job): 
+    # plays `players` games at once in this process, players alternate between the given routes
+    route_names, players = job
+    # imported here so the app is only set up in processes that play (and after main() has set the environment)
+    from app import app, store
+    from state_store import encode_state
+
+    # one untimed game per route first, so template compiling and other first-request work isn't measured
+    for name in route_names: 
+        client = app.test_client()
+        timed_request(client, 'play', 'Your journey begins')
+        for action, expected in ROUTES[name]: 
+            timed_request(client, action, expected)
+
+    memory_before = rss()
+    games = [(app.test_client(), ROUTES[route_names[n % len(route_names)]]) for n in range(players)]
+    latencies = []
+    for client, _ in games: 
+        latencies.append(timed_request(client, 'play', 'Your journey begins'))
+    for step in range(max(len(route) for _, route in games)): 
+        for client, route in games: 
+            if step < len(route): 
+                action, expected = route[step]
+                latencies.append(timed_request(client, action, expected))
+    memory_after = rss()
+
+    cookie_bytes = []
+    state_bytes = []
+    for client, _ in games: 
+        cookie = next(cookie for cookie in client.cookie_jar if cookie.name == app.session_cookie_name)
+        cookie_bytes.append(len(cookie.value))
+        with client.session_transaction() as session: 
+            user_id = session['user_id']
+        state_bytes.append(len(encode_state(store.load(user_id))))
+
+    return {
+        'latencies': latencies,
+        'cookie_bytes': cookie_bytes,
+        'state_bytes': state_bytes,
+        'rss_growth': memory_after - memory_before,
+    }
+
+
+def percentile(ordered, fraction): 
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main(): 
+    parser = argparse.ArgumentParser(description="Simulate many players walking scripted routes through the game")
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--route', choices=sorted(ROUTES), action='append', help="route to play (repeatable, default: all)")
+    parser.add_argument('--json', action='store_true', help="print the results as json")
+    args = parser.parse_args()
+    route_names = args.route or sorted(ROUTES)
+
+    # every game has to stay in the state store for the whole run, and the story and action logs of fake players
+    # go somewhere temporary
+    os.environ.setdefault('STATE_CACHE_SIZE', str(args.players + len(route_names) * args.processes))
+    work = tempfile.mkdtemp(prefix='load_test_')
+    os.environ.setdefault('STORY_LOG_DIR', os.path.join(work, 'story_logs'))
+    os.environ.setdefault('EVENT_LOG_DIR', os.path.join(work, 'event_logs'))
+
+    shares = [args.players // args.processes + (n < args.players % args.processes) for n in range(args.processes)]
+    jobs = [(route_names, share) for share in shares if share]
+    start = time.perf_counter()
+    if len(jobs) == 1: 
+        results = [run_players(jobs[0])]
+    else: 
+        with Pool(len(jobs)) as pool: 
+            results = pool.map(run_players, jobs)
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    cookie_bytes = [size for result in results for size in result['cookie_bytes']]
+    state_bytes = [size for result in results for size in result['state_bytes']]
+    report = {
+        'players': args.players,
+        'processes': len(jobs),
+        'routes': route_names,
+        'backend': os.environ.get('STATE_BACKEND', 'memory'),
+        'requests': len(latencies),
+        'seconds': elapsed,
+        # wall time includes setting up the processes and the untimed warm-up games, so this is a lower bound
+        'requests_per_second': len(latencies) / elapsed,
+        'latency_ms': {name: percentile(latencies, fraction) * 1000 for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1))},
+        'cookie_bytes_per_player': sum(cookie_bytes) / len(cookie_bytes),
+        'state_bytes_per_player': sum(state_bytes) / len(state_bytes),
+        'state_bytes_max': max(state_bytes),
+        'rss_bytes_per_player': sum(result['rss_growth'] for result in results) / args.players,
+    }
+
+    if args.json: 
+        print(json.dumps(report, indent=2))
+        return
+    latency = report['latency_ms']
+    print(f"{report['players']} players in {report['processes']} process(es), routes: {', '.join(route_names)}, state backend: {report['backend']}")
+    print(f"{report['requests']} requests in {elapsed:.2f}s: {report['requests_per_second']:.0f} requests/s")
+    print(f"latency: p50 {latency['p50']:.2f} ms, p90 {latency['p90']:.2f} ms, p99 {latency['p99']:.2f} ms, max {latency['max']:.2f} ms")
+    print(f"session cookie: {report['cookie_bytes_per_player']:.0f} bytes/player")
+    print(f"server-side state: {report['state_bytes_per_player']:.0f} bytes/player on average, {report['state_bytes_max']} at most")
+    print(f"memory: {report['rss_bytes_per_player'] / 1024:.1f} kB RSS/player")
+
+
+if __name__ == '__main__': 
+    main()
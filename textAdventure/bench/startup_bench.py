@@ -0,0 +1,143 @@
+# cold start benchmark: how long a new process takes to import the app and to answer its first request,
+# i.e. what the first player pays when a host that scaled to zero wakes an instance up
+# every run starts a fresh interpreter. the first run starts with no world pack and no compiled templates on disk,
+# like a fresh copy of the build, the later runs find the ones the first run left behind
+# run from the textAdventure directory: python bench/startup_bench.py [--runs 5] [--json]
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+
+
+def free_port(): 
+    with socket.socket() as s: 
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def interpreter_seconds(): 
+    # a bare interpreter starting and exiting, paid before any of the app's code runs
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - start
+
+
+def import_seconds(env): 
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=APP_DIR, env=env, check=True, capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+
+def get(port, path, headers=None): 
+    # returns how long the request took in seconds and the response body
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    start = time.perf_counter()
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    if response.status != 200: 
+        raise RuntimeError(f"GET {path} returned {response.status}")
+    return elapsed, body, response.getheader('Set-Cookie')
+
+
+def serve_once(env): 
+    # starts "python app.py", waits for it to take connections and plays the first requests of a new player
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, 'app.py'], cwd=APP_DIR, env=dict(env, PORT=str(port)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try: 
+        while True: 
+            try: 
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError: 
+                if server.poll() is not None: 
+                    raise RuntimeError("the server exited before it took any connections")
+                time.sleep(0.002)
+        listening = time.perf_counter() - start
+        first, _, cookie = get(port, '/play')
+        first_response = time.perf_counter() - start
+        second, _, _ = get(port, '/north', {'Cookie': cookie.split(';')[0]})
+        _, body, _ = get(port, '/ready')
+    finally: 
+        server.terminate()
+        server.wait()
+    return {
+        'listening': listening,
+        'first_response': first_response,
+        'first_request': first,
+        'second_request': second,
+        'server_startup': json.loads(body)['startup_seconds'],
+    }
+
+
+def run(runs): 
+    # everything the app writes goes to a temporary directory, including the world's pack
+    work = tempfile.mkdtemp()
+    try: 
+        world_file = os.path.join(work, 'world.json')
+        shutil.copy(os.path.join(APP_DIR, 'worlds', 'default.json'), world_file)
+        env = dict(
+            os.environ,
+            WORLD_FILE=world_file,
+            TEMPLATE_CACHE_DIR=os.path.join(work, 'template_cache'),
+            STORY_LOG_DIR=os.path.join(work, 'story_logs'),
+            EVENT_LOG_DIR=os.path.join(work, 'event_logs'),
+            SECRET_KEY='startup-bench',
+            STATE_BACKEND='memory',
+        )
+        results = []
+        for _ in range(runs): 
+            result = serve_once(env)
+            result['interpreter'] = interpreter_seconds()
+            result['import'] = import_seconds(env)
+            results.append(result)
+        return results
+    finally: 
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def ms(seconds): 
+    return f"{seconds * 1000:7.1f} ms"
+
+
+if __name__ == '__main__': 
+    parser = argparse.ArgumentParser(description="Measure import time and first-request latency of a fresh app process")
+    parser.add_argument('--runs', type=int, default=5, help="fresh processes to start (the first one with empty caches)")
+    parser.add_argument('--json', action='store_true', help="print the results as json")
+    args = parser.parse_args()
+
+    results = run(max(args.runs, 1))
+    if args.json: 
+        print(json.dumps(results, indent=2))
+        sys.exit()
+
+    print("run    interpreter  import app   listening    first response  first request  second request")
+    for number, result in enumerate(results): 
+        label = 'cold' if number == 0 else f"warm{number}"
+        print(f"{label:6} {ms(result['interpreter'])}  {ms(result['import'])}  {ms(result['listening'])}  {ms(result['first_response'])}     {ms(result['first_request'])}     {ms(result['second_request'])}")
+    if len(results) > 1: 
+        warm = results[1:]
+        print(f"warm median: import {ms(statistics.median(r['import'] for r in warm)).strip()}, "
+              f"first response {ms(statistics.median(r['first_response'] for r in warm)).strip()} after start, "
+              f"first request {ms(statistics.median(r['first_request'] for r in warm)).strip()}")
+    print(f"cold run, as the server saw it: imported {results[0]['server_startup']['imported']}s, warmed up {results[0]['server_startup']['warmed']}s, "
+          f"first response {results[0]['server_startup']['first_response']}s after app.py started loading")
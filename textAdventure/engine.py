@@ -0,0 +1,363 @@
+# the game's rules without any web framework: moving, grabbing, using items and describing rooms
+# Engine.step(state, action) runs one action on a player's state and returns the state with the lines of story
+# the action produced. app.py (and asgi.py through it) only load and save states and keep the story, so the
+# engine can also be driven directly, e.g. by a simulation playing many games at once in one process
+# a state is a plain dict (see world.py for its keys) and is changed in place, nothing in the world ever is
+
+from contextlib import nullcontext
+from functools import lru_cache
+
+from fragments import FragmentCache
+from world import chunk_of, CHUNK_SHIFT
+
+# bumped whenever the layout of a player's state changes
+STATE_VERSION = 3
+
+# id lists that are turned into ordered sets (dicts with None values) while a state is being played,
+# so membership checks are O(1) and the order items were picked up in is kept
+ID_SET_FIELDS = ('inventory', 'taken', 'unlocked', 'used')
+
+INTRO = """Your journey begins...
+    <br><br>
+    <b>Press h for help with commands</b>
+    """
+
+key_methods = [
+    "H: display quick rundown of methods",
+    "M: view map",
+    "I: view inventory",
+    "W, A, S, D: North, West, South, East",
+    "G: grab",
+    "U: use",
+    "N: inspect (allows you to view the descriptions of all current items in your inventory)",
+    "V: save the game to a file",
+    "R: restore a saved game"
+]
+
+MAP_LEGEND = "key: <br>@: current location<br>?: not yet discovered<br>#: wall<br>&nbsp;: open area/able to go through"
+
+
+def unpack_state(saved): 
+    # stored state -> a new state in the form the engine works on, saved itself is left as it is
+    # (a store may hand back an object something else is still holding on to)
+    # games saved in an older layout can't be continued, so they start over
+    if not saved or saved.get('version') != STATE_VERSION: 
+        return {}
+    player_state = dict(saved)
+    for field in ID_SET_FIELDS: 
+        if field in player_state: 
+            player_state[field] = dict.fromkeys(player_state[field])
+    return player_state
+
+
+def pack_state(player_state): 
+    # state being played -> a new state with plain id lists, ready to be stored; player_state is left as it is,
+    # so it can go on being played (e.g. by an open websocket) after it has been saved
+    packed = dict(player_state)
+    for field in ID_SET_FIELDS: 
+        if field in packed: 
+            packed[field] = list(packed[field])
+    return packed
+
+
+class Engine: 
+    # every action a player can take, by name
+    ACTIONS = ('north', 'west', 'south', 'east', 'grab', 'use', 'help', 'display_inventory', 'inspect')
+
+    def __init__(self, world, fragments=None, phase=None): 
+        self.world = world
+        self.fragments = fragments or FragmentCache(world)
+        # phase(name) returns a context manager timing that part of an action (app.py passes its metrics),
+        # by default nothing is timed
+        self.phase = phase or (lambda name: nullcontext())
+        # cached on the bitsets, so a row is only drawn again after something in it is revealed
+        self.map_row = lru_cache(maxsize=4096)(self._map_row)
+        self.reveal_masks = lru_cache(maxsize=65536)(self._reveal_masks)
+        self._actions = {name: getattr(self, name) for name in self.ACTIONS}
+
+    def new_game(self): 
+        # a fresh state and the lines the story starts with
+        # the world itself is shared, a player's state only records what they have changed
+        player_state = {
+            'version': STATE_VERSION,
+            'coords': list(self.world.start),
+            'revealed': {},
+            'inventory': {},
+            'taken': {},
+            'unlocked': {},
+            'used': {},
+            'mutations': [],
+        }
+        return player_state, [INTRO, self.world.tile(*self.world.start).description]
+
+    def resume(self, saved): 
+        # the saved fields of a state (see snapshot.py) -> a state to play on and the description of where it is
+        player_state = unpack_state(dict(saved, version=STATE_VERSION))
+        lines = []
+        self.room_description(player_state, lines)
+        return player_state, lines
+
+    def step(self, player_state, action): 
+        # runs one action, returns the (changed) state and the lines of story it produced
+        try: 
+            handler = self._actions[action]
+        except KeyError: 
+            raise ValueError(f"Unknown action: {action}") from None
+        lines = []
+        handler(player_state, lines)
+        return player_state, lines
+
+    # coords represent coordinates of current location
+    def refresh_map(self, player_state, coords): 
+        revealed = player_state['revealed']
+
+        # reveal tiles around new spot (concealed --> revealed)
+        for chunk_name, mask in self.reveal_masks(coords[0], coords[1]): 
+            revealed[chunk_name] = revealed.get(chunk_name, 0) | mask
+
+    def _reveal_masks(self, y, x): 
+        # the bits standing at y, x reveals: (chunk name, bitset) for every chunk the tiles around it are in
+        # the same for everyone, so it is only worked out once per tile
+        masks = {}
+        for i in range(y - 1, y + 2): 
+            for j in range(x - 1, x + 2): 
+                # ensures that the element attempting to be accessed is actually on the grid
+                if self.world.cell(i, j) is not None: 
+                    key, offset = chunk_of(i, j)
+                    # one bit per tile for each chunk the player has been near (see world.py)
+                    chunk_name = f"{key[0]},{key[1]}"
+                    masks[chunk_name] = masks.get(chunk_name, 0) | (1 << offset)
+        return tuple(masks.items())
+
+    def apply_mutation(self, player_state, name, lines): 
+        # e.g. driftwood_to_torch: the driftwood becomes a torch in the player's inventory and the cave is lit
+        mutation = self.world.mutations[name]
+        coords = player_state['coords']
+        inventory = player_state['inventory']
+
+        player_state['mutations'].append(name)
+
+        for item_id in mutation.inventory: 
+            if item_id not in inventory: 
+                inventory[item_id] = None
+
+        # nothing cached has to be thrown away: the mutation is part of every room fragment's key,
+        # so from now on this player gets the fragments for the changed world
+        if tuple(coords) in mutation.tiles: 
+            self.room_description(player_state, lines)
+
+    def current_tile(self, player_state): 
+        coords = player_state['coords']
+        return self.world.tile(coords[0], coords[1], player_state['mutations'])
+
+    def tile_items(self, player_state, tile): 
+        # items on the tile that haven't been picked up yet
+        return [self.world.item(item_id, player_state['mutations']) for item_id in tile.items if item_id not in player_state['taken']]
+
+    def is_restricted(self, player_state, item): 
+        return item.restricted and item.id not in player_state['unlocked']
+
+    def room_description(self, player_state, lines): 
+        coords = player_state['coords']
+        current_room = self.current_tile(player_state)
+        # what the room says only depends on the tile and, for each item still on it, whether it is unlocked
+        item_states = tuple((item_id, item_id in player_state['unlocked']) for item_id in current_room.items if item_id not in player_state['taken'])
+        key = ('room', coords[0], coords[1], tuple(player_state['mutations']), item_states)
+
+        with self.phase('room_description'): 
+            lines.extend(self.fragments.get(key, lambda: self.render_room(player_state, current_room)))
+
+    def render_room(self, player_state, current_room): 
+        lines = [current_room.description]
+
+        for item in self.tile_items(player_state, current_room): 
+            if not self.is_restricted(player_state, item) and item.environment_effect: 
+                lines.append(item.environment_effect)
+            elif self.is_restricted(player_state, item) and item.hidden_description: 
+                lines.append(item.hidden_description)
+
+        return tuple(lines)
+
+    def _map_row(self, i, j_start, j_stop, row_bits, mutations): 
+        # the cells of one map row, row_bits are the revealed bitsets of the chunks the row passes through
+        cells = []
+        first_chunk = j_start >> CHUNK_SHIFT
+        for j in range(j_start, j_stop): 
+            cell = self.world.cell(i, j)
+            if cell is None: 
+                cells.append("?")
+                continue
+            offset = chunk_of(i, j)[1]
+            tile = self.world.tile(i, j, mutations)
+            if row_bits[(j >> CHUNK_SHIFT) - first_chunk] >> offset & 1: 
+                cells.append(tile.revealed)
+            else: 
+                cells.append(tile.concealed)
+        return tuple(cells)
+
+    def map_view(self, player_state, radius): 
+        # the map isn't part of the story, it is drawn on request (app.py shows it in its own panel)
+        coords = player_state['coords']
+        revealed = player_state['revealed']
+        mutations = tuple(player_state['mutations'])
+
+        map_display = ""
+
+        # only the part of the map around the player is drawn, however big the world is
+        j_start = max(coords[1] - radius, 0)
+        j_stop = min(coords[1] + radius + 1, self.world.width)
+        chunk_columns = range(j_start >> CHUNK_SHIFT, ((j_stop - 1) >> CHUNK_SHIFT) + 1)
+        for i in range(max(coords[0] - radius, 0), min(coords[0] + radius + 1, self.world.height)): 
+            chunk_row = i >> CHUNK_SHIFT
+            row_bits = tuple(revealed.get(f"{chunk_row},{column}", 0) for column in chunk_columns)
+            cells = self.map_row(i, j_start, j_stop, row_bits, mutations)
+            if i == coords[0]: 
+                cells = cells[:coords[1] - j_start] + ("@",) + cells[coords[1] - j_start + 1:]
+            map_display += "&nbsp;&nbsp;".join(cells) + "&nbsp;&nbsp;<br>"
+
+        map_display += self.fragments.get(('legend',), lambda: MAP_LEGEND)
+
+        return map_display
+
+    # actions, each adds the lines it produces to lines
+    def display_inventory(self, player_state, lines): 
+        inventory = player_state['inventory']
+
+        if len(inventory) == 0: 
+            lines.append("Inventory is empty")
+        else: 
+            inventory_display = "Inventory: <br><ul>"
+            for item_id in inventory: 
+                this_item = self.world.item(item_id, player_state['mutations'])
+                inventory_display += f"<li>{this_item.name}</li>"
+            inventory_display += "</ul>"
+            lines.append(inventory_display)
+
+    def help(self, player_state, lines): 
+        lines.extend(self.fragments.get(('help',), lambda: tuple(method + "<br>" for method in key_methods)))
+
+    def move(self, player_state, lines, hv): 
+        coords = player_state['coords']
+
+        new_coords = [coords[0], coords[1]]
+
+        if hv == "N": 
+            new_coords[0] -= 1
+        elif hv == "S": 
+            new_coords[0] += 1
+        elif hv == "W": 
+            new_coords[1] -= 1
+        elif hv == "E": 
+            new_coords[1] += 1
+
+        if not self.world.in_bounds(new_coords[0], new_coords[1]): 
+            lines.append(f'You cannot move {hv} (out of map scope)')
+            return
+
+        new_location = self.world.cell(new_coords[0], new_coords[1])
+
+        if new_location is None: 
+            lines.append("This part of the map has not yet been developed...wait for future releases to explore here!")
+            return
+
+        if new_location.revealed == "#": 
+            lines.append(f"You cannot move {hv} (blocked by wall: #)")
+            return
+
+        player_state['coords'] = new_coords
+
+        self.room_description(player_state, lines)
+
+        self.refresh_map(player_state, new_coords)
+
+    def north(self, player_state, lines): 
+        self.move(player_state, lines, "N")
+
+    def west(self, player_state, lines): 
+        self.move(player_state, lines, "W")
+
+    def south(self, player_state, lines): 
+        self.move(player_state, lines, "S")
+
+    def east(self, player_state, lines): 
+        self.move(player_state, lines, "E")
+
+    def grab(self, player_state, lines): 
+        inventory = player_state['inventory']
+        taken = player_state['taken']
+
+        current_items = self.tile_items(player_state, self.current_tile(player_state))
+
+        if not current_items: 
+            lines.append("There is nothing to grab here.")
+            return
+
+        # items detected
+        nothing_added = True
+
+        # current_items is its own list, so marking items as taken while looping can't skip any
+        for item in current_items: 
+            if not self.is_restricted(player_state, item) and item.id not in inventory: 
+                inventory[item.id] = None
+                taken[item.id] = None
+                if item.when_grabbed: 
+                    lines.append(item.when_grabbed)
+                lines.append(f"Added to inventory: {item.name}: {item.description}<br>")
+                nothing_added = False
+
+        if nothing_added: 
+            lines.append("There is nothing you can grab here at the moment")
+
+    def use(self, player_state, lines): 
+        coords = player_state['coords']
+        inventory = player_state['inventory']
+        used = player_state['used']
+        unlocked = player_state['unlocked']
+        taken = player_state['taken']
+
+        already_used = False
+
+        with self.phase('use_unlocks'): 
+            for item_id in list(inventory): 
+                # only the rules for this tile and item are looked at, see World.build_unlock_index()
+                for unlock_id in self.world.unlocks_at(coords[0], coords[1], item_id): 
+                    if unlock_id in unlocked or unlock_id in taken: 
+                        continue
+                    # the tile may have changed since the world was built (e.g. the lit cave no longer has driftwood)
+                    if unlock_id not in self.current_tile(player_state).items: 
+                        continue
+
+                    item = self.world.item(item_id, player_state['mutations'])
+                    if not already_used and item_id not in used: 
+                        lines.append(f"Successfully used {item.name} to {item.action}")
+                        already_used = True
+                    if item_id not in used: 
+                        used[item_id] = None
+                        if item.when_used: 
+                            self.apply_mutation(player_state, item.when_used, lines)
+                            # the mutation can take the target off the tile
+                            if unlock_id not in self.current_tile(player_state).items: 
+                                continue
+
+                    unlocked[unlock_id] = None
+                    unlocked_item = self.world.item(unlock_id, player_state['mutations'])
+                    if unlocked_item.when_revealed: 
+                        lines.append(unlocked_item.when_revealed)
+
+        if not already_used: 
+            lines.append("You cannot use that item here")
+
+    def inspect(self, player_state, lines): 
+        inventory = player_state['inventory']
+
+        if len(inventory) == 0: 
+            lines.append("You do not have any items in your inventory")
+            return
+
+        text = ""
+        text += "Here are your items: <br>"
+        for item_id in inventory: 
+            item = self.world.item(item_id, player_state['mutations'])
+            text += f"&nbsp;&nbsp;{item.name}: {item.description}<br>"
+
+        lines.append(text)
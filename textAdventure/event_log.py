@@ -0,0 +1,126 @@
+# append-only log of every action each player has taken, so a game can be rebuilt, replayed or debugged
+# each player gets two files:
+#   <user_id>.events: one byte per action, its position in EVENTS, so event n is the player's nth action
+#   <user_id>.snaps: save files (see snapshot.py) taken along the way, each followed by a SNAPSHOT_FOOTER
+#                    (its length and how many events had happened when it was taken), so the latest one
+#                    is read from the end of the file with one seek
+# a game's state is the latest snapshot with the events after it replayed on top (see replay()),
+# a log with no snapshot at event 0 starts from a new game
+
+import os
+import struct
+
+from story_log import SAFE_ID
+
+# the codes are stored in every log, so actions are only ever added to the end
+EVENTS = ('north', 'west', 'south', 'east', 'grab', 'use', 'help', 'display_inventory', 'inspect', 'clear')
+EVENT_CODES = {name: code for code, name in enumerate(EVENTS)}
+
+SNAPSHOT_FOOTER = struct.Struct('<IQ')
+
+
+class EventLog: 
+    def __init__(self, directory='event_logs'): 
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, user_id): 
+        if not SAFE_ID.match(user_id): 
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        base = os.path.join(self.directory, user_id)
+        return base + '.events', base + '.snaps'
+
+    def user_ids(self): 
+        return sorted(name[:-len('.events')] for name in os.listdir(self.directory) if name.endswith('.events'))
+
+    def count(self, user_id): 
+        try: 
+            return os.path.getsize(self._paths(user_id)[0])
+        except FileNotFoundError: 
+            return 0
+
+    def append(self, user_id, names): 
+        # returns how many events the log holds afterwards
+        with open(self._paths(user_id)[0], 'ab') as events: 
+            events.write(bytes(EVENT_CODES[name] for name in names))
+            return events.tell()
+
+    def read(self, user_id, start=0): 
+        # the names of the events from start on
+        try: 
+            with open(self._paths(user_id)[0], 'rb') as events: 
+                events.seek(start)
+                data = events.read()
+        except FileNotFoundError: 
+            return []
+        if any(code >= len(EVENTS) for code in data): 
+            raise ValueError(f"Event log of {user_id} has an unknown action")
+        return [EVENTS[code] for code in data]
+
+    def add_snapshot(self, user_id, position, data): 
+        # data is a save file of the game after its first position events
+        with open(self._paths(user_id)[1], 'ab') as snaps: 
+            snaps.write(data + SNAPSHOT_FOOTER.pack(len(data), position))
+
+    def latest_snapshot(self, user_id): 
+        # (position, save file) of the newest snapshot, None if there isn't one
+        try: 
+            with open(self._paths(user_id)[1], 'rb') as snaps: 
+                end = snaps.seek(0, os.SEEK_END)
+                if end < SNAPSHOT_FOOTER.size: 
+                    return None
+                snaps.seek(end - SNAPSHOT_FOOTER.size)
+                length, position = SNAPSHOT_FOOTER.unpack(snaps.read(SNAPSHOT_FOOTER.size))
+                snaps.seek(end - SNAPSHOT_FOOTER.size - length)
+                return position, snaps.read(length)
+        except FileNotFoundError: 
+            return None
+
+    def snapshots(self, user_id): 
+        # every (position, save file), oldest first
+        try: 
+            with open(self._paths(user_id)[1], 'rb') as snaps: 
+                data = snaps.read()
+        except FileNotFoundError: 
+            return []
+        found = []
+        end = len(data)
+        while end >= SNAPSHOT_FOOTER.size: 
+            length, position = SNAPSHOT_FOOTER.unpack_from(data, end - SNAPSHOT_FOOTER.size)
+            start = end - SNAPSHOT_FOOTER.size - length
+            if start < 0: 
+                raise ValueError(f"Snapshots of {user_id} are damaged")
+            found.append((position, data[start:end - SNAPSHOT_FOOTER.size]))
+            end = start
+        return found[::-1]
+
+    def restart(self, user_id, data): 
+        # the game was replaced by a restored save (data): its log starts over from it
+        self.delete(user_id)
+        self.add_snapshot(user_id, 0, data)
+
+    def delete(self, user_id): 
+        for path in self._paths(user_id): 
+            try: 
+                os.remove(path)
+            except FileNotFoundError: 
+                pass
+
+
+def replay(engine, names, saved=None): 
+    # the saved fields of a snapshot (see decode_snapshot()), or a new game if there are none, with names
+    # played on top, returns the state and its story cursor (seq)
+    if saved is None: 
+        player_state, lines = engine.new_game()
+        seq = len(lines)
+    else: 
+        saved = dict(saved)
+        seq = saved.pop('seq')
+        player_state, _ = engine.resume(saved)
+    for name in names: 
+        if name == 'clear': 
+            # handled by app.py, it only empties the story and adds one line
+            seq += 1
+        else: 
+            seq += len(engine.step(player_state, name)[1])
+    return player_state, seq
@@ -0,0 +1,36 @@
+# pre-rendered html for the parts of the story that are the same for everyone in the same situation
+# (room descriptions, the help text, the map legend), so they are put together once instead of on every request
+# a fragment is stored under the world's version plus a key describing everything it depends on,
+# e.g. a room is keyed on its position, the player's world changes and the state of the items on it,
+# so a change like driftwood_to_torch simply leads to a different fragment and a new world file to new ones
+
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache: 
+    # in-process LRU like MemoryStore, fragments are immutable (strings or tuples of strings) so they can be shared
+    def __init__(self, world, capacity=4096): 
+        self.world = world
+        self.capacity = capacity
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, render): 
+        # returns the fragment for key, calling render() to build it the first time
+        key = (self.world.version,) + key
+        with self._lock: 
+            fragment = self._fragments.get(key)
+            if fragment is not None: 
+                self._fragments.move_to_end(key)
+                return fragment
+        fragment = render()
+        with self._lock: 
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.capacity: 
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def clear(self): 
+        with self._lock: 
+            self._fragments.clear()
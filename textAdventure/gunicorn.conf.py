@@ -0,0 +1,12 @@
+# gunicorn settings for running several workers (see README)
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# import the app (and build the world) once in the master process, the workers share it through fork
+preload_app = True
+
+# game state has to be visible to every worker, the in-process memory store isn't
+os.environ.setdefault('STATE_BACKEND', 'sqlite')
@@ -0,0 +1,90 @@
+# conditional GETs and response compression
+# pages carry a strong ETag, so a browser revalidating an unchanged page gets an empty 304 back instead of the page,
+# and anything textual over a size threshold is sent gzip (or brotli, if the brotli package is installed) compressed
+# a compressed response gets its own ETag (the tag with the encoding's suffix), strong tags have to differ per
+# encoding, and etag_matches() takes the suffix off again when the browser sends the tag back
+
+import hashlib
+from functools import lru_cache
+
+from werkzeug.wrappers import Response
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript')
+
+# preferred first
+ENCODING_SUFFIXES = {'br': '-br', 'gzip': '-gz'}
+
+
+@lru_cache(maxsize=None)
+def brotli_module(): 
+    # brotli is optional, without it responses are only ever gzipped
+    try: 
+        import brotli
+    except ImportError: 
+        return None
+    return brotli
+
+
+def file_hash(path): 
+    # a short hash of a file's contents, used to version its url
+    with open(path, 'rb') as f: 
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def etag_matches(request, etag): 
+    # the tag in the If-None-Match header that is etag, with or without an encoding's suffix, None if there isn't one
+    # (the 304 is sent with the tag the browser has, so it keeps matching the copy it has cached)
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag: 
+        return etag
+    for tag in if_none_match.as_set(include_weak=True): 
+        base = tag
+        for suffix in ENCODING_SUFFIXES.values(): 
+            if tag.endswith(suffix): 
+                base = tag[:-len(suffix)]
+                break
+        if base == etag: 
+            return tag
+    return None
+
+
+def not_modified(etag, cache_control): 
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def choose_encoding(accept_encodings): 
+    for encoding in ENCODING_SUFFIXES: 
+        if accept_encodings.quality(encoding) > 0 and (encoding != 'br' or brotli_module()): 
+            return encoding
+    return None
+
+
+def compress_response(response, accept_encodings, min_size=1024, level=6): 
+    # compresses the body in place if it is text of at least min_size bytes and the browser accepts an encoding we have
+    # files sent straight from disk (direct passthrough) are left alone
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers: 
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES: 
+        return response
+    data = response.get_data()
+    if len(data) < min_size: 
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None: 
+        return response
+    if encoding == 'br': 
+        # brotli's quality goes up to 11, gzip's level to 9
+        response.set_data(brotli_module().compress(data, quality=min(level, 11)))
+    else: 
+        # imported here, most responses are too small to be compressed and startup doesn't need it
+        import gzip
+        response.set_data(gzip.compress(data, compresslevel=min(level, 9), mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag: 
+        response.set_etag(etag + ENCODING_SUFFIXES[encoding], weak)
+    return response
@@ -0,0 +1,165 @@
+# request instrumentation: counters and histograms in the prometheus text format, plus a sampling profiler
+# everything here is per process, with several gunicorn workers each one has its own numbers
+# when metrics are disabled phase() hands back one shared do-nothing context manager and app.py doesn't
+# install any of its hooks, so the game pays for a single attribute check per timed phase
+
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+# seconds, from 50 microseconds (a cached fragment) up to a second (something is badly wrong)
+TIME_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+LINE_BUCKETS = (10, 25, 50, 100, 200, 500, 1000)
+
+NO_PHASE = nullcontext()
+
+
+class Phase: 
+    # times the block it wraps into the phase histogram
+    __slots__ = ('metrics', 'labels', 'start')
+
+    def __init__(self, metrics, labels): 
+        self.metrics = metrics
+        self.labels = labels
+
+    def __enter__(self): 
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info): 
+        self.metrics.observe('game_phase_seconds', time.perf_counter() - self.start, self.labels)
+
+
+class Metrics: 
+    def __init__(self, enabled=False): 
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # name -> (type, help text, buckets or None)
+        self._families = {}
+        # name -> labels -> value for counters, [count per bucket..., sum] for histograms
+        self._values = {}
+
+    def counter(self, name, help_text): 
+        self._families[name] = ('counter', help_text, None)
+        self._values[name] = {}
+
+    def histogram(self, name, help_text, buckets): 
+        self._families[name] = ('histogram', help_text, buckets)
+        self._values[name] = {}
+
+    def inc(self, name, labels=(), amount=1): 
+        # labels are a tuple of (label, value) pairs
+        values = self._values[name]
+        with self._lock: 
+            values[labels] = values.get(labels, 0) + amount
+
+    def observe(self, name, value, labels=()): 
+        buckets = self._families[name][2]
+        values = self._values[name]
+        with self._lock: 
+            counts = values.get(labels)
+            if counts is None: 
+                # one count per bucket, one for +Inf, then the sum
+                counts = values[labels] = [0] * (len(buckets) + 2)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+
+    def phase(self, name, route): 
+        if not self.enabled: 
+            return NO_PHASE
+        return Phase(self, (('route', route), ('phase', name)))
+
+    def render(self): 
+        # the prometheus text exposition format
+        lines = []
+        with self._lock: 
+            for name, (kind, help_text, buckets) in self._families.items(): 
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self._values[name].items()): 
+                    if kind == 'counter': 
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), value): 
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {value[-1]}")
+                    lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels): 
+    if not labels: 
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class SamplingProfiler: 
+    # while running, a background thread looks at the stack of every other thread each `interval` seconds
+    # and counts them, collapsed() returns the counts as "outer;...;inner count" lines, which flamegraph.pl
+    # and speedscope can draw, so it is clear where time goes without tracing every call
+    def __init__(self, interval=0.005): 
+        self.interval = interval
+        self._samples = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        # only the thread that forks carries on in a forked process (e.g. a gunicorn worker of a preloaded app),
+        # so the child starts with no sampler and locks of its own
+        if hasattr(os, 'register_at_fork'): 
+            os.register_at_fork(after_in_child=self._forked)
+
+    @property
+    def running(self): 
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self): 
+        with self._lock: 
+            if self.running: 
+                return
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stopped,), name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self): 
+        thread = self._thread
+        if thread is None: 
+            return
+        self._stopped.set()
+        if thread.is_alive(): 
+            thread.join()
+        self._thread = None
+
+    def _forked(self): 
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def reset(self): 
+        with self._lock: 
+            self._samples.clear()
+
+    def collapsed(self): 
+        with self._lock: 
+            return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common())
+
+    def _run(self, stopped): 
+        own_id = threading.get_ident()
+        while not stopped.wait(self.interval): 
+            stacks = []
+            for thread_id, frame in sys._current_frames().items(): 
+                if thread_id == own_id: 
+                    continue
+                names = []
+                while frame is not None: 
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(names)))
+            with self._lock: 
+                self._samples.update(stacks)
@@ -0,0 +1,132 @@
+# replays every player's action log (see event_log.py) through the game rules to catch regressions:
+# python replay.py [event log directory] [--world worlds/some_world.json] [--processes N] [--json]
+# each log is played from its first snapshot (or a new game) and the state is checked against every later snapshot,
+# so a change to the engine or the world that would give a player a different game than the one they played shows
+# up as a mismatch at the first action where they part ways
+# exits with status 1 if any log doesn't match or fails to replay
+#
+# logs are independent, so they are shared out over a pool of processes, each with its own world and engine
+
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from engine import Engine
+from event_log import EventLog, replay
+from snapshot import decode_snapshot
+from world import build_world
+
+# the fields of a state a snapshot records (seq is left out, the story's length isn't part of the game)
+COMPARED_FIELDS = ('coords', 'inventory', 'taken', 'unlocked', 'used', 'mutations', 'revealed')
+
+# set in each pool worker by init_worker()
+worker = None
+
+
+def init_worker(directory, world_path): 
+    global worker
+    world = build_world(world_path)
+    worker = (EventLog(directory), world, Engine(world))
+
+
+def differences(player_state, saved): 
+    # the fields where a replayed state and a snapshot's saved fields disagree
+    found = []
+    for field in COMPARED_FIELDS: 
+        replayed = player_state[field]
+        recorded = saved[field]
+        if field in ('taken', 'unlocked', 'used'): 
+            replayed, recorded = sorted(replayed), sorted(recorded)
+        elif field == 'inventory': 
+            replayed = list(replayed)
+        if replayed != recorded: 
+            found.append(field)
+    return found
+
+
+def play(engine, player_state, names): 
+    for name in names: 
+        # clear only empties the story
+        if name != 'clear': 
+            engine.step(player_state, name)
+
+
+def check(user_id): 
+    # replays one log, returns (user_id, result, events, detail)
+    # result is ok, mismatch, error or skipped (the log starts from a save of another version of the world)
+    event_log, world, engine = worker
+    try: 
+        names = event_log.read(user_id)
+        snapshots = event_log.snapshots(user_id)
+    except (OSError, ValueError) as e: 
+        return user_id, 'error', 0, str(e)
+
+    saved = None
+    if snapshots and snapshots[0][0] == 0: 
+        try: 
+            saved = decode_snapshot(snapshots.pop(0)[1], world)
+        except ValueError as e: 
+            return user_id, 'skipped', len(names), str(e)
+
+    position = 0
+    try: 
+        player_state, _ = replay(engine, [], saved)
+        for snapshot_position, data in snapshots: 
+            try: 
+                recorded = decode_snapshot(data, world)
+            except ValueError: 
+                # taken before the world was changed, only the replay itself can be checked
+                continue
+            play(engine, player_state, names[position:snapshot_position])
+            position = snapshot_position
+            found = differences(player_state, recorded)
+            if found: 
+                return user_id, 'mismatch', len(names), f"at event {position}: {', '.join(found)} differ"
+        play(engine, player_state, names[position:])
+    except Exception as e: 
+        return user_id, 'error', len(names), f"replay failed after event {position}: {e!r}"
+    return user_id, 'ok', len(names), None
+
+
+def main(): 
+    parser = argparse.ArgumentParser(description="Replay every action log through the game rules and check it against its snapshots")
+    parser.add_argument('directory', nargs='?', default=os.environ.get('EVENT_LOG_DIR', 'event_logs'), help="event log directory (default: EVENT_LOG_DIR or event_logs)")
+    parser.add_argument('--world', default=None, help="world file (default: WORLD_FILE or worlds/default.json)")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--json', action='store_true', help="print the report as json")
+    args = parser.parse_args()
+
+    user_ids = EventLog(args.directory).user_ids()
+    processes = max(min(args.processes or os.cpu_count() or 1, len(user_ids)), 1)
+    start = time.perf_counter()
+    if processes > 1: 
+        with Pool(processes, initializer=init_worker, initargs=(args.directory, args.world)) as pool: 
+            results = list(pool.imap_unordered(check, user_ids, chunksize=max(len(user_ids) // (processes * 8), 1)))
+    else: 
+        init_worker(args.directory, args.world)
+        results = [check(user_id) for user_id in user_ids]
+    seconds = time.perf_counter() - start
+
+    totals = {'ok': 0, 'mismatch': 0, 'error': 0, 'skipped': 0}
+    for _, result, _, _ in results: 
+        totals[result] += 1
+    events = sum(count for _, _, count, _ in results)
+    problems = sorted((user_id, result, detail) for user_id, result, _, detail in results if result != 'ok')
+    report = dict(totals, logs=len(results), events=events, seconds=round(seconds, 3), problems=problems)
+
+    if args.json: 
+        print(json.dumps(report, indent=2))
+    else: 
+        print(f"{len(results)} logs, {events} events replayed in {seconds:.2f}s ({events / max(seconds, 1e-9):,.0f} events/s)")
+        print(f"ok: {totals['ok']}, mismatch: {totals['mismatch']}, error: {totals['error']}, skipped: {totals['skipped']}")
+        for user_id, result, detail in problems: 
+            print(f"  {user_id}: {result}: {detail}")
+
+    return 1 if totals['mismatch'] or totals['error'] else 0
+
+
+if __name__ == '__main__': 
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# save files: a player's progress packed into a few hundred bytes, so a game survives cleared cookies,
+# a new secret key or a new server
+# only what the player has changed is saved (the world itself never is), so restoring a save is decoding a
+# short byte string into a new game state, with no world to rebuild
+#
+# layout: SNAPSHOT_HEADER (magic, format version) followed by a raw deflate stream of
+#   the world's version (8 bytes), then varints: y, x, story cursor (seq),
+#   inventory: count, item ids in the order they were picked up
+#   taken, unlocked, used: each a byte count and a little-endian bitset of item ids
+#   mutations: count, indexes into the world's list of effects
+#   revealed: count, then for each chunk: chunk y, chunk x, byte count and its little-endian bitset
+# saves are player supplied, so decoding raises ValueError for anything that doesn't fit the world: unknown items,
+# effects or map chunks, and a position the player couldn't stand on (undeveloped or a wall)
+# it doesn't check that the game could have been played that way, e.g. a crafted save can hold an item that
+# was never unlocked, which only gives a player what they could have had anyway
+
+import struct
+import zlib
+
+from world import CHUNK_SIZE
+
+SNAPSHOT_HEADER = struct.Struct('<2sB')
+SNAPSHOT_MAGIC = b'TA'
+# bumped whenever the layout above changes
+SNAPSHOT_VERSION = 1
+# a save never gets anywhere near this, it only stops a hostile upload from inflating into something huge
+MAX_SNAPSHOT_SIZE = 1 << 20
+
+
+def write_varint(out, value): 
+    while value > 0x7f: 
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def write_bitset(out, bits): 
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    write_varint(out, len(data))
+    out += data
+
+
+class Reader: 
+    def __init__(self, data): 
+        self.data = data
+        self.position = 0
+
+    def bytes(self, length): 
+        end = self.position + length
+        if end > len(self.data): 
+            raise ValueError("Save file is truncated")
+        chunk = self.data[self.position:end]
+        self.position = end
+        return chunk
+
+    def varint(self): 
+        value = 0
+        shift = 0
+        while True: 
+            byte = self.bytes(1)[0]
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80: 
+                return value
+            shift += 7
+            if shift > 63: 
+                raise ValueError("Save file has an invalid number")
+
+    def bitset(self): 
+        return int.from_bytes(self.bytes(self.varint()), 'little')
+
+
+def bits_of(ids): 
+    bits = 0
+    for item_id in ids: 
+        bits |= 1 << item_id
+    return bits
+
+
+def ids_of(bits): 
+    ids = []
+    item_id = 0
+    while bits: 
+        if bits & 1: 
+            ids.append(item_id)
+        bits >>= 1
+        item_id += 1
+    return ids
+
+
+def encode_snapshot(player_state, world): 
+    mutation_names = list(world.mutations)
+    out = bytearray(bytes.fromhex(world.version))
+    coords = player_state['coords']
+    write_varint(out, coords[0])
+    write_varint(out, coords[1])
+    write_varint(out, player_state.get('seq', 0))
+
+    inventory = list(player_state['inventory'])
+    write_varint(out, len(inventory))
+    for item_id in inventory: 
+        write_varint(out, item_id)
+    for field in ('taken', 'unlocked', 'used'): 
+        write_bitset(out, bits_of(player_state[field]))
+
+    write_varint(out, len(player_state['mutations']))
+    for name in player_state['mutations']: 
+        write_varint(out, mutation_names.index(name))
+
+    revealed = player_state['revealed']
+    write_varint(out, len(revealed))
+    for key, bits in revealed.items(): 
+        chunk_y, chunk_x = key.split(',')
+        write_varint(out, int(chunk_y))
+        write_varint(out, int(chunk_x))
+        write_bitset(out, bits)
+
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION) + compressor.compress(bytes(out)) + compressor.flush()
+
+
+def decode_snapshot(data, world): 
+    # save file -> the saved fields of a player's state (ids as lists, like the stored state)
+    if len(data) < SNAPSHOT_HEADER.size: 
+        raise ValueError("Not a save file")
+    magic, version = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC: 
+        raise ValueError("Not a save file")
+    if version != SNAPSHOT_VERSION: 
+        raise ValueError(f"Save file format {version} is not supported")
+    decompressor = zlib.decompressobj(-15)
+    try: 
+        body = decompressor.decompress(data[SNAPSHOT_HEADER.size:], MAX_SNAPSHOT_SIZE)
+    except zlib.error: 
+        raise ValueError("Save file is damaged") from None
+    if decompressor.unconsumed_tail: 
+        raise ValueError("Save file is too big")
+
+    reader = Reader(body)
+    if reader.bytes(8).hex() != world.version: 
+        raise ValueError("Save file is from a different version of the world")
+    coords = [reader.varint(), reader.varint()]
+    cell = world.cell(coords[0], coords[1])
+    if cell is None: 
+        raise ValueError("Save file position is not on the map")
+    # the same test Engine.move() uses
+    if cell.revealed == "#": 
+        raise ValueError("Save file position is inside a wall")
+    seq = reader.varint()
+
+    item_count = len(world.items)
+    inventory = [reader.varint() for _ in range(reader.varint())]
+    if any(item_id >= item_count for item_id in inventory): 
+        raise ValueError("Save file refers to an unknown item")
+    flags = []
+    for _ in range(3): 
+        bits = reader.bitset()
+        if bits >> item_count: 
+            raise ValueError("Save file refers to an unknown item")
+        flags.append(ids_of(bits))
+    taken, unlocked, used = flags
+
+    mutation_names = list(world.mutations)
+    mutations = []
+    for _ in range(reader.varint()): 
+        index = reader.varint()
+        if index >= len(mutation_names): 
+            raise ValueError("Save file refers to an unknown effect")
+        mutations.append(mutation_names[index])
+
+    revealed = {}
+    for _ in range(reader.varint()): 
+        chunk_y, chunk_x = reader.varint(), reader.varint()
+        bits = reader.bitset()
+        if bits >> (CHUNK_SIZE * CHUNK_SIZE): 
+            raise ValueError("Save file has an invalid map")
+        revealed[f"{chunk_y},{chunk_x}"] = bits
+
+    if reader.position != len(body): 
+        raise ValueError("Save file has trailing data")
+
+    return {
+        'coords': coords,
+        'seq': seq,
+        'inventory': inventory,
+        'taken': taken,
+        'unlocked': unlocked,
+        'used': used,
+        'mutations': mutations,
+        'revealed': revealed,
+    }
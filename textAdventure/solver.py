@@ -0,0 +1,315 @@
+# checks a world can still be finished: python solver.py [worlds/some_world.json] [--processes N] [--json]
+# reports items no player can ever get, items that can each be got but never all held at once (e.g. two keys
+# whose effects each clear the other's tile), softlocks (states the game can get into from which not every
+# obtainable item can be reached any more), dead tiles (developed floor no player can walk to)
+# and the shortest solution (the fewest actions that end with every obtainable item in the inventory)
+# exits with status 1 if there are unreachable items, items that can't be held together or softlocks,
+# so it can run before a world is deployed
+#
+# the search is over position x inventory x item flags, but walls never change, so it doesn't go tile by tile:
+#  1. the floor reachable from the start is flood filled once, and the walking distance between every pair of
+#     "item tiles" (tiles where grab or use can do something) is found by one BFS per item tile, run in a pool
+#  2. a search over (item tile, flags) then only has three kinds of step: walk to another item tile, grab, use.
+#     grab and use are run through engine.Engine so the rules can't drift from the game's, and every
+#     (tile, flags) node is hashed as a tuple of ints so each one is expanded once
+# walks cost several moves, so step 2 is a Dijkstra rather than a plain BFS, which keeps the solution shortest
+
+import argparse
+import heapq
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+from engine import Engine, STATE_VERSION
+from snapshot import bits_of, ids_of
+from world import build_world
+
+def walkable_mask(world): 
+    # one byte per tile, 1 where a player can stand (developed and not a wall, the same test move() uses)
+    mask = bytearray(world.height * world.width)
+    for y, x, tile in world.grid.tiles(): 
+        if tile.revealed != "#": 
+            mask[y * world.width + x] = 1
+    return mask
+
+
+def item_tiles(world): 
+    # every tile where grab or use can change something, including tiles an effect puts items on
+    positions = {(y, x) for y, x, tile in world.grid.tiles() if tile.items}
+    for mutation in world.mutations.values(): 
+        positions.update(position for position, tile in mutation.tiles.items() if tile.items)
+    positions.update((y, x) for y, x, _ in world.unlock_index)
+    return sorted(positions)
+
+
+# set in each pool worker by init_worker(), so the mask is sent to a worker once rather than with every task
+grid = None
+
+
+def init_worker(mask, height, width): 
+    global grid
+    grid = (mask, height, width)
+
+
+def neighbours(cell, mask, height, width): 
+    y, x = divmod(cell, width)
+    if y > 0 and mask[cell - width]: 
+        yield cell - width
+    if y < height - 1 and mask[cell + width]: 
+        yield cell + width
+    if x > 0 and mask[cell - 1]: 
+        yield cell - 1
+    if x < width - 1 and mask[cell + 1]: 
+        yield cell + 1
+
+
+def distances(job): 
+    # BFS from one cell, returns the number of moves to each target (None if it can't be reached)
+    # stops as soon as every target has been found, so small worlds inside big maps stay cheap
+    source, targets = job
+    mask, height, width = grid
+    remaining = set(targets)
+    found = {}
+    seen = bytearray(len(mask))
+    seen[source] = 1
+    frontier = [source]
+    steps = 0
+    while frontier and remaining: 
+        for cell in frontier: 
+            if cell in remaining: 
+                found[cell] = steps
+                remaining.discard(cell)
+        following = []
+        for cell in frontier: 
+            for neighbour in neighbours(cell, mask, height, width): 
+                if not seen[neighbour]: 
+                    seen[neighbour] = 1
+                    following.append(neighbour)
+        frontier = following
+        steps += 1
+    return [found.get(target) for target in targets]
+
+
+def flood_fill(source, mask, height, width): 
+    seen = bytearray(len(mask))
+    seen[source] = 1
+    frontier = [source]
+    while frontier: 
+        following = []
+        for cell in frontier: 
+            for neighbour in neighbours(cell, mask, height, width): 
+                if not seen[neighbour]: 
+                    seen[neighbour] = 1
+                    following.append(neighbour)
+        frontier = following
+    return seen
+
+
+def walk(source, target, mask, height, width): 
+    # the moves of one shortest walk from source to target
+    parents = {source: None}
+    frontier = [source]
+    while target not in parents: 
+        following = []
+        for cell in frontier: 
+            for neighbour in neighbours(cell, mask, height, width): 
+                if neighbour not in parents: 
+                    parents[neighbour] = cell
+                    following.append(neighbour)
+        frontier = following
+    moves = []
+    cell = target
+    while parents[cell] is not None: 
+        previous = parents[cell]
+        difference = cell - previous
+        moves.append({-width: 'north', width: 'south', -1: 'west', 1: 'east'}[difference])
+        cell = previous
+    return moves[::-1]
+
+
+class Solver: 
+    def __init__(self, world, processes=None): 
+        self.world = world
+        self.engine = Engine(world)
+        self.processes = processes or os.cpu_count() or 1
+        self.mutation_names = list(world.mutations)
+
+    def to_state(self, position, flags): 
+        inventory, taken, unlocked, used, mutations = flags
+        return {
+            'version': STATE_VERSION,
+            'coords': list(position),
+            'revealed': {},
+            'inventory': dict.fromkeys(ids_of(inventory)),
+            'taken': dict.fromkeys(ids_of(taken)),
+            'unlocked': dict.fromkeys(ids_of(unlocked)),
+            'used': dict.fromkeys(ids_of(used)),
+            'mutations': [self.mutation_names[index] for index in mutations],
+        }
+
+    def to_flags(self, player_state): 
+        return (
+            bits_of(player_state['inventory']),
+            bits_of(player_state['taken']),
+            bits_of(player_state['unlocked']),
+            bits_of(player_state['used']),
+            tuple(self.mutation_names.index(name) for name in player_state['mutations']),
+        )
+
+    def run(self): 
+        world = self.world
+        height, width = world.height, world.width
+        mask = walkable_mask(world)
+        start = world.start[0] * width + world.start[1]
+
+        reachable = flood_fill(start, mask, height, width)
+        dead_tiles = [divmod(cell, width) for cell in range(len(mask)) if mask[cell] and not reachable[cell]]
+
+        # item tiles nobody can walk to can't matter to the search, they show up as dead tiles
+        places = [position for position in item_tiles(world) if reachable[position[0] * width + position[1]]]
+        if tuple(world.start) not in places: 
+            places.insert(0, tuple(world.start))
+        cells = [y * width + x for y, x in places]
+        jobs = [(cell, cells) for cell in cells]
+        if self.processes > 1 and len(jobs) > 1: 
+            with Pool(min(self.processes, len(jobs)), initializer=init_worker, initargs=(mask, height, width)) as pool: 
+                table = pool.map(distances, jobs)
+        else: 
+            init_worker(mask, height, width)
+            table = [distances(job) for job in jobs]
+
+        explored, edges = self.explore(places, table)
+
+        obtainable = 0
+        for _, flags in explored: 
+            obtainable |= flags[0]
+        goals = [node for node in explored if node[1][0] == obtainable]
+
+        # items that are missing from an inventory no other inventory holds more than (every item can be got,
+        # but not every one by the same player), empty whenever there is a goal
+        inventories = {flags[0] for _, flags in explored}
+        largest = [bits for bits in inventories if not any(other != bits and other & bits == bits for other in inventories)]
+        held_together = obtainable
+        for bits in largest: 
+            held_together &= bits
+        not_together = obtainable & ~held_together
+
+        softlocks = []
+        if goals: 
+            # softlocks: explored states from which no goal state can be reached any more
+            # (without a goal state the world can't be finished at all, which not_together already reports)
+            reverse = {}
+            for node, targets in edges.items(): 
+                for _, target, _ in targets: 
+                    reverse.setdefault(target, []).append(node)
+            can_finish = set(goals)
+            frontier = list(goals)
+            while frontier: 
+                node = frontier.pop()
+                for previous in reverse.get(node, ()): 
+                    if previous not in can_finish: 
+                        can_finish.add(previous)
+                        frontier.append(previous)
+            softlocks = sorted((node for node in explored if node not in can_finish), key=lambda node: explored[node][0])
+
+        return {
+            'items': len(world.items),
+            'states': len(explored),
+            'unreachable_items': [world.items[item_id].name for item_id in range(len(world.items)) if not obtainable >> item_id & 1],
+            'not_together_items': [world.items[item_id].name for item_id in ids_of(not_together)],
+            'softlocks': len(softlocks),
+            'softlock_example': self.actions_to(softlocks[0], explored, places, mask) if softlocks else None,
+            'dead_tiles': dead_tiles,
+            'solution': self.actions_to(min(goals, key=lambda node: explored[node][0]), explored, places, mask) if goals else None,
+        }
+
+    def explore(self, places, table): 
+        # Dijkstra over (index into places, flags), returns node -> (actions to get there, previous node, step)
+        # and node -> [(step, next node, cost)]
+        start = (places.index(tuple(self.world.start)), (0, 0, 0, 0, ()))
+        explored = {}
+        edges = {}
+        queue = [(0, 0, start, None, None)]
+        tiebreak = 1
+        while queue: 
+            cost, _, node, previous, step = heapq.heappop(queue)
+            if node in explored: 
+                continue
+            explored[node] = (cost, previous, step)
+            place, flags = node
+            steps = []
+            for action in ('grab', 'use'): 
+                player_state, _ = self.engine.step(self.to_state(places[place], flags), action)
+                following = self.to_flags(player_state)
+                if following != flags: 
+                    steps.append((action, (place, following), 1))
+            for other, moves in enumerate(table[place]): 
+                if other != place and moves is not None: 
+                    steps.append(('walk', (other, flags), moves))
+            edges[node] = steps
+            for action, target, step_cost in steps: 
+                if target not in explored: 
+                    heapq.heappush(queue, (cost + step_cost, tiebreak, target, node, action))
+                    tiebreak += 1
+        return explored, edges
+
+    def actions_to(self, node, explored, places, mask): 
+        # the actions from the start of the game to node, with each walk written out move by move
+        steps = []
+        while explored[node][1] is not None: 
+            _, previous, action = explored[node]
+            steps.append((previous, action, node))
+            node = previous
+        width = self.world.width
+        actions = []
+        for previous, action, node in reversed(steps): 
+            if action == 'walk': 
+                source = places[previous[0]]
+                target = places[node[0]]
+                actions += walk(source[0] * width + source[1], target[0] * width + target[1], mask, self.world.height, width)
+            else: 
+                actions.append(action)
+        return actions
+
+
+def main(): 
+    parser = argparse.ArgumentParser(description="Check that every item in a world can be reached and find the shortest solution")
+    parser.add_argument('world', nargs='?', help="world file (default: WORLD_FILE or worlds/default.json)")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes for the distance search (default: one per CPU)")
+    parser.add_argument('--json', action='store_true', help="print the report as json")
+    args = parser.parse_args()
+
+    world = build_world(args.world)
+    report = Solver(world, processes=args.processes).run()
+
+    if args.json: 
+        print(json.dumps(report, indent=2))
+    else: 
+        print(f"{report['items']} items, {report['states']} distinct game states explored")
+        if report['unreachable_items']: 
+            print(f"unreachable items: {', '.join(report['unreachable_items'])}")
+        else: 
+            print("every item can be reached")
+        if report['not_together_items']: 
+            print(f"items that can't all be held at once: {', '.join(report['not_together_items'])}")
+        if report['softlocks']: 
+            print(f"softlocks: {report['softlocks']} states can't be finished from, e.g. after: {' '.join(report['softlock_example'])}")
+        else: 
+            print("no softlocks")
+        if report['dead_tiles']: 
+            shown = ', '.join(f"{y},{x}" for y, x in report['dead_tiles'][:10])
+            more = f" and {len(report['dead_tiles']) - 10} more" if len(report['dead_tiles']) > 10 else ""
+            print(f"dead tiles (floor that can't be walked to): {shown}{more}")
+        else: 
+            print("no dead tiles")
+        if report['solution'] is None: 
+            print("no solution: no game ends with every obtainable item in the inventory")
+        else: 
+            print(f"shortest solution ({len(report['solution'])} actions): {' '.join(report['solution'])}")
+
+    return 1 if report['unreachable_items'] or report['not_together_items'] or report['softlocks'] else 0
+
+
+if __name__ == '__main__': 
+    sys.exit(main())
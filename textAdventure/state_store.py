@@ -0,0 +1,119 @@
+# server-side storage for each player's game state
+# the session cookie only carries the user_id, everything else lives in one of these stores
+# every store has the same interface: load(user_id) -> state or None, save(user_id, state), delete(user_id)
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def encode_state(state): 
+    return json.dumps(state, separators=(',', ':')).encode('utf-8')
+
+
+def decode_state(data): 
+    if data is None: 
+        return None
+    return json.loads(data)
+
+
+class MemoryStore: 
+    # in-process LRU dict, least recently played games are dropped once capacity is reached
+    # states are kept encoded like the other stores keep them, so every load is a copy of its own and nothing
+    # a request does to its state reaches the store (or anyone else's copy) before it is saved
+    def __init__(self, capacity=10000): 
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, user_id): 
+        with self._lock: 
+            data = self._data.get(user_id)
+            if data is not None: 
+                self._data.move_to_end(user_id)
+        return decode_state(data)
+
+    def save(self, user_id, state): 
+        data = encode_state(state)
+        with self._lock: 
+            self._data[user_id] = data
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.capacity: 
+                self._data.popitem(last=False)
+
+    def delete(self, user_id): 
+        with self._lock: 
+            self._data.pop(user_id, None)
+
+
+class SQLiteStore: 
+    # local sqlite file, one row per player
+    # sqlite3 is only imported once a SQLiteStore is made, so the other backends don't load it at startup
+    def __init__(self, path='game_state.db'): 
+        import sqlite3
+        self.sqlite3 = sqlite3
+        self.path = path
+        self._local = threading.local()
+        conn = sqlite3.connect(self.path, timeout=10)
+        with conn: 
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS game_state (user_id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        conn.close()
+
+    def _connect(self): 
+        # sqlite connections can't be shared between threads or forked processes,
+        # so each thread of each worker opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid(): 
+            conn = self.sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, user_id): 
+        row = self._connect().execute("SELECT data FROM game_state WHERE user_id = ?", (user_id,)).fetchone()
+        return decode_state(row[0]) if row else None
+
+    def save(self, user_id, state): 
+        with self._connect() as conn: 
+            conn.execute("INSERT OR REPLACE INTO game_state (user_id, data) VALUES (?, ?)", (user_id, encode_state(state)))
+
+    def delete(self, user_id): 
+        with self._connect() as conn: 
+            conn.execute("DELETE FROM game_state WHERE user_id = ?", (user_id,))
+
+
+class RedisStore: 
+    # works with anything that has redis-py's get/set/delete methods
+    # if no client is given, redis-py is imported and connected to REDIS_URL
+    def __init__(self, client=None, url=None, prefix='game_state:', ttl=None): 
+        if client is None: 
+            import redis
+            client = redis.Redis.from_url(url or os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def load(self, user_id): 
+        return decode_state(self.client.get(self.prefix + user_id))
+
+    def save(self, user_id, state): 
+        self.client.set(self.prefix + user_id, encode_state(state), ex=self.ttl)
+
+    def delete(self, user_id): 
+        self.client.delete(self.prefix + user_id)
+
+
+def create_store(backend=None): 
+    # picks the backend from the STATE_BACKEND environment variable (memory, sqlite or redis)
+    backend = backend or os.environ.get('STATE_BACKEND', 'memory')
+    if backend == 'memory': 
+        return MemoryStore(capacity=int(os.environ.get('STATE_CACHE_SIZE', 10000)))
+    if backend == 'sqlite': 
+        return SQLiteStore(path=os.environ.get('STATE_SQLITE_PATH', 'game_state.db'))
+    if backend == 'redis': 
+        ttl = os.environ.get('STATE_TTL')
+        return RedisStore(ttl=int(ttl) if ttl else None)
+    raise ValueError(f"Unknown state backend: {backend}")
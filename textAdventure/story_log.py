@@ -0,0 +1,75 @@
+# append-only log of the story lines that no longer fit in a player's story buffer
+# each player gets two files:
+#   <user_id>.log: the lines, each stored as a 4 byte length followed by the utf-8 text
+#   <user_id>.idx: one 8 byte offset into the .log file per line
+# line n of the log is the line with seq n, so any page of older story can be read with two seeks
+
+import os
+import re
+import struct
+
+RECORD_LENGTH = struct.Struct('<I')
+INDEX_ENTRY = struct.Struct('<Q')
+# user ids are uuids, anything else could be used to escape the log directory
+SAFE_ID = re.compile(r'^[0-9a-fA-F-]+$')
+
+
+class StoryLog: 
+    def __init__(self, directory='story_logs'): 
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, user_id): 
+        if not SAFE_ID.match(user_id): 
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        base = os.path.join(self.directory, user_id)
+        return base + '.log', base + '.idx'
+
+    def count(self, user_id): 
+        index_path = self._paths(user_id)[1]
+        try: 
+            return os.path.getsize(index_path) // INDEX_ENTRY.size
+        except FileNotFoundError: 
+            return 0
+
+    def append(self, user_id, lines): 
+        if not lines: 
+            return
+        log_path, index_path = self._paths(user_id)
+        with open(log_path, 'ab') as log, open(index_path, 'ab') as index: 
+            offset = log.seek(0, os.SEEK_END)
+            records = []
+            offsets = []
+            for line in lines: 
+                data = line.encode('utf-8')
+                offsets.append(INDEX_ENTRY.pack(offset))
+                records.append(RECORD_LENGTH.pack(len(data)))
+                records.append(data)
+                offset += RECORD_LENGTH.size + len(data)
+            log.write(b''.join(records))
+            index.write(b''.join(offsets))
+
+    def read(self, user_id, start, stop): 
+        # returns the lines with seq start..stop-1 (as far as they are in the log)
+        start = max(start, 0)
+        stop = min(stop, self.count(user_id))
+        if stop <= start: 
+            return []
+        log_path, index_path = self._paths(user_id)
+        with open(index_path, 'rb') as index: 
+            index.seek(start * INDEX_ENTRY.size)
+            first_offset = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+        lines = []
+        with open(log_path, 'rb') as log: 
+            log.seek(first_offset)
+            for _ in range(stop - start): 
+                length = RECORD_LENGTH.unpack(log.read(RECORD_LENGTH.size))[0]
+                lines.append(log.read(length).decode('utf-8'))
+        return lines
+
+    def delete(self, user_id): 
+        for path in self._paths(user_id): 
+            try: 
+                os.remove(path)
+            except FileNotFoundError: 
+                pass
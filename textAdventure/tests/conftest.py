@@ -0,0 +1,35 @@
+# run from the repository or the textAdventure directory: python -m pytest -q
+# everything the app writes (story and action logs, compiled templates) goes to a temporary directory,
+# and the app is imported from the textAdventure directory like the server does
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, APP_DIR)
+
+WORK_DIR = tempfile.mkdtemp(prefix='text-adventure-tests-')
+os.environ.setdefault('STATE_BACKEND', 'memory')
+os.environ.setdefault('SECRET_KEY', 'tests')
+os.environ['STORY_LOG_DIR'] = os.path.join(WORK_DIR, 'story_logs')
+os.environ['EVENT_LOG_DIR'] = os.path.join(WORK_DIR, 'event_logs')
+os.environ['TEMPLATE_CACHE_DIR'] = os.path.join(WORK_DIR, 'template_cache')
+
+
+@pytest.fixture
+def client(): 
+    # a new player: their own test client, so their own session cookie and game
+    from app import app
+    client = app.test_client()
+    response = client.get('/play')
+    # for talking to the same game over the websocket (asgi.py)
+    client.session_cookie = response.headers['Set-Cookie'].split(';')[0]
+    return client
+
+
+def play(client, *actions): 
+    # runs actions one request at a time, returns the lines each of them added to the story
+    return [client.get('/' + action).get_json()['lines'] for action in actions]
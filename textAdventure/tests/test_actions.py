@@ -0,0 +1,39 @@
+def whole_story(client): 
+    # every line of the player's story so far, from the story log and the buffer (short games fit one page)
+    page = client.get('/history?before=1000000&limit=200').get_json()
+    assert page['start'] == 0
+    return page['lines']
+
+
+def test_failed_batch_leaves_the_story_log_alone(client, monkeypatch): 
+    import app
+
+    step = app.engine.step
+
+    def failing_step(player_state, name): 
+        if name == 'grab': 
+            raise RuntimeError("grab failed")
+        return step(player_state, name)
+
+    before = client.post('/actions', json={'actions': ['north']}).get_json()
+    monkeypatch.setattr(app.engine, 'step', failing_step)
+    response = client.post('/actions', json={'actions': ['clear', 'north', 'grab']})
+    assert response.status_code == 500
+    monkeypatch.undo()
+
+    # the clear was rolled back with the rest of the batch, so its lines didn't go to the story log
+    # and the next clear moves each line there once, right after the ones before it
+    moved = client.post('/actions', json={'actions': ['north']}).get_json()
+    assert moved['seq'] == before['seq'] + len(moved['lines'])
+    update = client.post('/actions', json={'actions': ['clear']}).get_json()
+    lines = whole_story(client)
+    assert len(lines) == update['seq']
+    assert lines[before['seq'] - len(before['lines']):] == before['lines'] + moved['lines'] + ["Workspace cleared."]
+
+
+def test_every_action_has_an_event_code(): 
+    # app.py refuses to import otherwise, this says which list to fix
+    from app import ACTIONS
+    from event_log import EVENT_CODES
+
+    assert [name for name in ACTIONS if name not in EVENT_CODES] == []
@@ -0,0 +1,36 @@
+from conftest import play
+
+
+def test_grab_takes_every_unrestricted_item_on_the_tile(client): 
+    # start -> garden path (the key) -> secret garden, where the key unlocks the rose and the note
+    play(client, 'north', 'grab', 'north', 'use')
+    (grabbed,) = play(client, 'grab')
+    assert any('Added to inventory: Ageless Rose' in line for line in grabbed)
+    assert any('Added to inventory: Mysterious Note' in line for line in grabbed)
+
+    (inventory,) = play(client, 'display_inventory')
+    for name in ('Rusted Key', 'Ageless Rose', 'Mysterious Note'): 
+        assert name in inventory[0]
+
+
+def test_grab_again_takes_nothing(client): 
+    play(client, 'north', 'grab', 'north', 'use', 'grab')
+    (grabbed,) = play(client, 'grab')
+    assert grabbed == ["There is nothing to grab here."]
+
+
+def test_unpack_state_leaves_the_stored_state_alone(): 
+    from engine import Engine, unpack_state, pack_state
+    from world import build_world
+
+    engine = Engine(build_world())
+    player_state, _ = engine.new_game()
+    stored = pack_state(player_state)
+    unpacked = unpack_state(stored)
+    engine.step(unpacked, 'north')
+    engine.step(unpacked, 'grab')
+    assert isinstance(stored['inventory'], list) and stored['inventory'] == []
+    assert isinstance(unpacked['inventory'], dict) and len(unpacked['inventory']) == 1
+    # packing for the store doesn't turn the state being played back into lists either
+    pack_state(unpacked)
+    assert isinstance(unpacked['inventory'], dict)
@@ -0,0 +1,32 @@
+import os
+import time
+
+import pytest
+
+from metrics import SamplingProfiler
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_forked_process_starts_its_own_sampler(): 
+    # like a gunicorn worker forked from a master that had the profiler running
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    try: 
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0: 
+            # the sampler thread wasn't carried over, so it isn't reported as running and start() starts a new one
+            results = [profiler.running]
+            profiler.start()
+            time.sleep(0.05)
+            results += [profiler.running, bool(profiler.collapsed())]
+            profiler.stop()
+            os.write(write, bytes(results))
+            os._exit(0)
+        os.close(write)
+        os.waitpid(pid, 0)
+        assert os.read(read, 16) == bytes([False, True, True])
+        assert profiler.running
+    finally: 
+        profiler.stop()
+    assert not profiler.running
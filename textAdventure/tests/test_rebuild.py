@@ -0,0 +1,52 @@
+from conftest import play
+
+
+def forget_state(client): 
+    # what a restart with the memory store, or a state evicted from it, looks like to the player
+    from app import store
+    with client.session_transaction() as session: 
+        store.delete(session['user_id'])
+
+
+def test_actions_and_map_rebuild_a_lost_game(client): 
+    play(client, 'north', 'grab')
+    forget_state(client)
+    response = client.post('/actions', json={'actions': ['display_inventory']})
+    assert response.status_code == 200
+    assert 'Rusted Key' in response.get_json()['lines'][0]
+
+    forget_state(client)
+    assert client.get('/map').status_code == 200
+    (inventory,) = play(client, 'display_inventory')
+    assert 'Rusted Key' in inventory[0]
+
+
+def test_unknown_urls_start_no_game(): 
+    from app import app, store
+
+    client = app.test_client()
+    response = client.get('/favicon.ico')
+    assert response.status_code == 404
+    assert 'Set-Cookie' not in response.headers
+
+    # a route that doesn't play doesn't start one either
+    assert client.get('/history').status_code == 200
+    with client.session_transaction() as session: 
+        assert store.load(session['user_id']) is None
+
+
+def test_socket_map_rebuilds_a_lost_game(client): 
+    import asyncio
+    from test_websocket import Socket
+
+    play(client, 'north', 'grab')
+    forget_state(client)
+
+    async def main(): 
+        async with Socket(client.session_cookie) as socket: 
+            reply = await socket.send('map')
+            assert 'map' in reply
+            return await socket.send('display_inventory')
+
+    reply = asyncio.run(main())
+    assert 'Rusted Key' in reply['lines'][0]
@@ -0,0 +1,33 @@
+from conftest import play
+
+
+def test_save_and_restore(client): 
+    play(client, 'north', 'grab')
+    data = client.get('/save').data
+    play(client, 'north', 'use', 'grab')
+    response = client.post('/restore', data=data, content_type='application/octet-stream')
+    assert response.get_json() == {'restored': True}
+    (inventory,) = play(client, 'display_inventory')
+    assert 'Rusted Key' in inventory[0] and 'Ageless Rose' not in inventory[0]
+
+
+def test_restore_rejects_a_body_bigger_than_a_save_file(client): 
+    from snapshot import MAX_SNAPSHOT_SIZE
+
+    response = client.post('/restore', data=b'x' * (MAX_SNAPSHOT_SIZE + 1), content_type='application/octet-stream')
+    assert response.status_code == 413
+    response = client.post('/restore', data=b'x' * (MAX_SNAPSHOT_SIZE * 2), content_type='application/octet-stream')
+    assert response.status_code == 413
+
+
+def test_restore_rejects_a_position_inside_a_wall(client): 
+    from app import engine, world
+    from snapshot import encode_snapshot
+
+    player_state, _ = engine.new_game()
+    wall = next([y, x] for y in range(world.height) for x in range(world.width)
+                if world.cell(y, x) is not None and world.cell(y, x).revealed == "#")
+    player_state.update(coords=wall, seq=0)
+    response = client.post('/restore', data=encode_snapshot(player_state, world), content_type='application/octet-stream')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': "Save file position is inside a wall"}
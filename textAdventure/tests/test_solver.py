@@ -0,0 +1,32 @@
+import json
+import os
+
+from world import parse_world
+
+WORLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worlds')
+
+
+def load_world(name): 
+    # parsed straight from the json, so no pack is written next to the fixture
+    path = os.path.join(WORLDS, name)
+    with open(path, encoding='utf-8') as f: 
+        return parse_world(json.load(f), path)
+
+
+def test_default_world_can_be_finished(): 
+    from solver import Solver
+    from world import build_world
+
+    report = Solver(build_world(), processes=1).run()
+    assert report['unreachable_items'] == [] and report['not_together_items'] == [] and report['softlocks'] == 0
+    assert report['solution']
+
+
+def test_items_that_can_not_be_held_together(): 
+    # each key's effect empties the other key's chest, so either gem can be got but never both
+    from solver import Solver
+
+    report = Solver(load_world('exclusive_keys.json'), processes=1).run()
+    assert report['unreachable_items'] == []
+    assert sorted(report['not_together_items']) == ['Blue Gem', 'Clear Gem']
+    assert report['solution'] is None
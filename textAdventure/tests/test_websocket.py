@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+from conftest import play
+
+
+class Socket: 
+    # one player's /ws connection, driven a message at a time so HTTP requests can be made in between
+    def __init__(self, cookie): 
+        self.cookie = cookie
+        self.events = asyncio.Queue()
+        self.replies = asyncio.Queue()
+
+    async def __aenter__(self): 
+        from asgi import application
+
+        async def send(event): 
+            if event['type'] == 'websocket.send': 
+                await self.replies.put(json.loads(event['text']) if event.get('text') is not None else event['bytes'])
+
+        scope = {'type': 'websocket', 'path': '/ws', 'headers': [(b'cookie', self.cookie.encode())]}
+        self.events.put_nowait({'type': 'websocket.connect'})
+        self.task = asyncio.create_task(application(scope, self.events.get, send))
+        return self
+
+    async def send(self, message): 
+        key = 'bytes' if isinstance(message, bytes) else 'text'
+        await self.events.put({'type': 'websocket.receive', key: message})
+        return await asyncio.wait_for(self.replies.get(), 5)
+
+    async def __aexit__(self, *exc_info): 
+        await self.events.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+def test_http_requests_while_the_socket_is_open_share_its_game(client): 
+    async def main(): 
+        async with Socket(client.session_cookie) as socket: 
+            await socket.send('north')
+            await socket.send('grab')
+            # the page's own "Load earlier story" and map requests go over HTTP
+            assert client.get('/history').status_code == 200
+            assert client.get('/map').status_code == 200
+            # HTTP sees the game as the socket left it, not the last one saved
+            (inventory,) = play(client, 'display_inventory')
+            assert 'Rusted Key' in inventory[0]
+            # and the socket goes on with the move HTTP made
+            await socket.send('north')
+            reply = await socket.send('use')
+            assert any('Successfully used Rusted Key' in line for line in reply['lines'])
+            reply = await socket.send('grab')
+            assert any('Ageless Rose' in line for line in reply['lines'])
+
+    asyncio.run(main())
+    # closing the socket saved the game it ended with
+    (inventory,) = play(client, 'display_inventory')
+    assert 'Ageless Rose' in inventory[0]
+
+
+def test_http_move_while_the_socket_is_open_is_not_lost(client): 
+    async def main(): 
+        async with Socket(client.session_cookie) as socket: 
+            await socket.send('north')
+            play(client, 'grab')
+            reply = await socket.send('display_inventory')
+            assert 'Rusted Key' in reply['lines'][0]
+
+    asyncio.run(main())
+    (inventory,) = play(client, 'display_inventory')
+    assert 'Rusted Key' in inventory[0]
+
+
+def test_save_over_the_socket_has_the_moves_it_has_not_saved_yet(client): 
+    from snapshot import decode_snapshot
+    from app import world
+
+    async def main(): 
+        async with Socket(client.session_cookie) as socket: 
+            await socket.send('["north", "grab"]')
+            return await socket.send('save')
+
+    data = asyncio.run(main())
+    assert isinstance(data, bytes)
+    saved = decode_snapshot(data, world)
+    assert len(saved['inventory']) == 1
+
+
+async def http_get(path, cookie=''): 
+    # one GET through the ASGI application, returns the status
+    from asgi import application
+
+    sent = []
+
+    async def receive(): 
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(event): 
+        sent.append(event)
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 1234),
+    }
+    await application(scope, receive, send)
+    return sent[0]['status']
+
+
+def test_http_request_waiting_on_a_player_does_not_hold_up_others(client): 
+    from app import player_lock
+
+    with client.session_transaction() as session: 
+        lock = player_lock(session['user_id'])
+
+    async def main(): 
+        # like a websocket action of the player's that is still running
+        lock.acquire()
+        try: 
+            waiting = asyncio.create_task(http_get('/map', client.session_cookie))
+            await asyncio.sleep(0.05)
+            assert await asyncio.wait_for(http_get('/'), 5) == 200
+            assert not waiting.done()
+        finally: 
+            lock.release()
+        assert await asyncio.wait_for(waiting, 5) == 200
+
+    asyncio.run(main())
@@ -0,0 +1,460 @@
+# the game world: every room, item and the map layout
+# the world is built once per process and shared by every player, so nothing in here is ever changed while playing
+# each player's progress is stored separately as a small diff (see reset_variables() in app.py):
+#   coords: where the player is
+#   revealed: tiles the player has seen, as "chunk y,chunk x" -> bitset of the positions inside that chunk (see chunk_of())
+#   inventory: ids of the items the player is carrying
+#   taken: ids of items that have been picked up from the map
+#   unlocked: ids of restricted items that have been unlocked
+#   used: ids of items that have been used
+#   mutations: names of the world changes that have happened (e.g. driftwood_to_torch)
+
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import pickle
+import struct
+import sys
+from array import array
+
+# pack format version and the length of the pickled World, see compile_world()
+PACK_HEADER = struct.Struct('<II')
+
+
+class Item: 
+    # fields are stored in __slots__ so thousands of items don't each carry a __dict__,
+    # other items (unlocks) are referred to by id instead of being nested copies
+    __slots__ = ('id', 'name', 'description', 'restricted', 'when_grabbed', 'when_revealed', 'environment_effect', 'action', 'unlocks', 'hidden_description', 'when_used')
+
+    def __init__(self, name, description, restricted, action=None, when_used=None, when_grabbed=None, when_revealed=None, hidden_description=None, environment_effect=None, unlocks=None, id=None): 
+        # position of the item in World.items, used to refer to the item in a player's state
+        self.id = id
+        self.name = name
+        self.description = description
+        self.restricted = restricted
+        self.when_grabbed = when_grabbed
+        # text to be displayed when the item is grabbed
+        self.when_revealed = when_revealed
+        # text to be displayed only for unlocked items
+        self.environment_effect = environment_effect
+        # used {item} to _______
+        self.action = action
+        # ids of the items this item unlocks when used
+        self.unlocks = tuple(unlocks) if unlocks else ()
+        self.hidden_description = hidden_description
+        # name of the mutation that happens the first time the item is used
+        self.when_used = when_used
+
+    def to_dict(self): 
+        return {'id': self.id,
+                'name': self.name,
+                'description': self.description,
+                'restricted': self.restricted,
+                'when_revealed': self.when_revealed,
+                'action': self.action,
+                'environment_effect': self.environment_effect,
+                'hidden_description': self.hidden_description,
+                'unlocks': list(self.unlocks),
+                'when_grabbed': self.when_grabbed,
+                'when_used': self.when_used}
+
+    @staticmethod
+    def from_dict(data): 
+        return Item(id=data['id'],
+                    name=data['name'],
+                    description=data['description'],
+                    restricted=data['restricted'],
+                    when_revealed=data['when_revealed'],
+                    environment_effect=data['environment_effect'],
+                    action=data['action'],
+                    when_grabbed=data['when_grabbed'],
+                    hidden_description=data['hidden_description'],
+                    unlocks=data['unlocks'],
+                    when_used=data['when_used'])
+
+    def to_tuple(self): 
+        # compact form, the values in __slots__ order
+        return (self.id, self.name, self.description, self.restricted, self.when_grabbed, self.when_revealed, 
+                self.environment_effect, self.action, self.unlocks, self.hidden_description, self.when_used)
+
+    @staticmethod
+    def from_tuple(data): 
+        # fast path: fills the slots directly instead of going through __init__'s keyword arguments
+        item = Item.__new__(Item)
+        (item.id, item.name, item.description, item.restricted, item.when_grabbed, item.when_revealed, 
+         item.environment_effect, item.action, item.unlocks, item.hidden_description, item.when_used) = data
+        return item
+
+class MapLocation: 
+    __slots__ = ('concealed', 'revealed', 'items', 'description')
+
+    def __init__(self, concealed, revealed, description=None, items=None): 
+        self.concealed = concealed
+        self.revealed = revealed
+        # ids of the items that start on this tile
+        self.items = tuple(items) if items else ()
+        self.description = description
+
+    def to_dict(self): 
+        return {'concealed': self.concealed,
+                'revealed': self.revealed,
+                'description': self.description,
+                'items': list(self.items)}
+
+    @staticmethod
+    def from_dict(data): 
+        return MapLocation(concealed=data['concealed'],
+                           revealed=data['revealed'],
+                           description=data['description'],
+                           items=data['items'])
+
+    def to_tuple(self): 
+        return (self.concealed, self.revealed, self.items, self.description)
+
+    @staticmethod
+    def from_tuple(data): 
+        location = MapLocation.__new__(MapLocation)
+        location.concealed, location.revealed, location.items, location.description = data
+        return location
+
+
+def encode(objects): 
+    # binary codec for a list of items/locations, marshal handles tuples of str/int/bool/None natively
+    return marshal.dumps(tuple(obj.to_tuple() for obj in objects))
+
+
+def decode_items(data): 
+    return [Item.from_tuple(item) for item in marshal.loads(data)]
+
+
+def decode_locations(data): 
+    return [MapLocation.from_tuple(location) for location in marshal.loads(data)]
+
+
+class Mutation: 
+    # a change to the world that happens for one player, e.g. lighting the driftwood
+    # items and tiles replace the original ones while the mutation is active, inventory is given to the player
+    def __init__(self, items=None, tiles=None, inventory=None): 
+        self.items = items if items else {}
+        self.tiles = tiles if tiles else {}
+        self.inventory = tuple(inventory) if inventory else ()
+
+
+# the map is split into CHUNK_SIZE x CHUNK_SIZE chunks so big maps never have to be loaded or walked in full
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+
+
+def chunk_of(y, x): 
+    # chunk coordinates and the tile's position inside the chunk
+    return (y >> CHUNK_SHIFT, x >> CHUNK_SHIFT), ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+
+
+class ChunkedGrid: 
+    # sparse grid of tiles
+    # every distinct MapLocation is stored once in palette (palette[0] is None, an undeveloped tile)
+    # and a chunk is an array of CHUNK_SIZE * CHUNK_SIZE palette indices, chunks with no tiles aren't stored at all
+    # chunks can be loaded lazily through loader(chunk key), which is how packs are read (see load_pack())
+    def __init__(self, height, width, palette, chunks=None, loader=None): 
+        self.height = height
+        self.width = width
+        self.palette = tuple(palette)
+        self.chunks = chunks if chunks is not None else {}
+        self.loader = loader
+        # chunk key -> (offset, length) in a pack, set when the grid is saved into one
+        self.chunk_index = None
+
+    def chunk(self, key): 
+        try: 
+            return self.chunks[key]
+        except KeyError: 
+            chunk = self.loader(key) if self.loader else None
+            self.chunks[key] = chunk
+            return chunk
+
+    def get(self, y, x): 
+        key, offset = chunk_of(y, x)
+        chunk = self.chunk(key)
+        if chunk is None: 
+            return None
+        return self.palette[chunk[offset]]
+
+    def set(self, y, x, palette_index): 
+        key, offset = chunk_of(y, x)
+        chunk = self.chunks.get(key)
+        if chunk is None: 
+            chunk = self.chunks[key] = array('I', bytes(4 * CHUNK_SIZE * CHUNK_SIZE))
+        chunk[offset] = palette_index
+
+    def tiles(self): 
+        # every developed tile as (y, x, tile), loads every chunk so only meant for building the world
+        for (chunk_y, chunk_x) in list(self.chunk_keys()): 
+            chunk = self.chunk((chunk_y, chunk_x))
+            for offset, palette_index in enumerate(chunk): 
+                if palette_index: 
+                    yield (chunk_y << CHUNK_SHIFT) | (offset >> CHUNK_SHIFT), (chunk_x << CHUNK_SHIFT) | (offset & CHUNK_MASK), self.palette[palette_index]
+
+    def chunk_keys(self): 
+        if self.chunk_index is not None: 
+            return self.chunk_index.keys()
+        return self.chunks.keys()
+
+    def __getstate__(self): 
+        # the loader (an open pack) can't be pickled, packs store the chunks separately anyway
+        return {'height': self.height, 'width': self.width, 'palette': self.palette, 'chunks': {}, 'loader': None, 'chunk_index': self.chunk_index}
+
+
+class World: 
+    def __init__(self, items, grid, start, mutations, version=None): 
+        self.items = tuple(items)
+        # a ChunkedGrid, use cell(y, x) to look tiles up
+        self.grid = grid
+        self.height = grid.height
+        self.width = grid.width
+        self.start = tuple(start)
+        self.mutations = mutations
+        # changes whenever the world file does, anything cached from this world is keyed on it (see fragments.py)
+        self.version = version
+        self.unlock_index = self.build_unlock_index()
+
+    def build_unlock_index(self): 
+        # (y, x, item id) -> ids of the items on that tile which the item unlocks, so /use never has to search
+        # a tile counts every item that can be on it, including ones that only appear through a mutation
+        tile_versions = {}
+        for y, x, tile in self.grid.tiles(): 
+            if tile.items: 
+                tile_versions.setdefault((y, x), set()).update(tile.items)
+        unlockers = [item for item in self.items if item.unlocks]
+        for mutation in self.mutations.values(): 
+            for (y, x), tile in mutation.tiles.items(): 
+                if tile.items: 
+                    tile_versions.setdefault((y, x), set()).update(tile.items)
+            unlockers.extend(item for item in mutation.items.values() if item.unlocks)
+
+        index = {}
+        for (y, x), on_tile in tile_versions.items(): 
+            for item in unlockers: 
+                targets = tuple(unlock_id for unlock_id in item.unlocks if unlock_id in on_tile)
+                if targets: 
+                    index[(y, x, item.id)] = index.get((y, x, item.id), ()) + targets
+        return index
+
+    def unlocks_at(self, y, x, item_id): 
+        return self.unlock_index.get((y, x, item_id), ())
+
+    def in_bounds(self, y, x): 
+        return 0 <= y < self.height and 0 <= x < self.width
+
+    def item(self, item_id, mutations=()): 
+        for name in mutations: 
+            replacement = self.mutations[name].items.get(item_id)
+            if replacement: 
+                return replacement
+        return self.items[item_id]
+
+    def tile(self, y, x, mutations=()): 
+        for name in mutations: 
+            replacement = self.mutations[name].tiles.get((y, x))
+            if replacement: 
+                return replacement
+        return self.grid.get(y, x)
+
+    def cell(self, y, x): 
+        # the unmutated tile, None if it isn't developed or is off the map
+        if not self.in_bounds(y, x): 
+            return None
+        return self.grid.get(y, x)
+
+
+# worlds are written as json files in worlds/ (see worlds/default.json):
+#   items: item name -> fields of Item, unlocks lists item names, when_used names an effect
+#   tiles: tile name -> fields of MapLocation, items lists item names
+#   legend + map: one character per tile, rows from north to south, a legend of null means not developed yet
+#   effects: effect name -> items/tiles to change (only the fields given are replaced) and items given to the player
+# the json is compiled into a pickled World (a "pack") next to it, so starting the game is a single unpickle
+
+DEFAULT_WORLD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worlds', 'default.json')
+
+# bumped whenever World or the classes in it change, so old packs are rebuilt
+PACK_VERSION = 3
+
+ITEM_FIELDS = ('name', 'description', 'restricted', 'action', 'when_used', 'when_grabbed', 'when_revealed', 'hidden_description', 'environment_effect')
+TILE_FIELDS = ('concealed', 'revealed', 'description')
+
+
+def _item(item_id, data, item_ids, path): 
+    unknown = set(data) - set(ITEM_FIELDS) - {'unlocks'}
+    if unknown: 
+        raise ValueError(f"{path}: unknown item fields {sorted(unknown)}")
+    try: 
+        unlocks = [item_ids[name] for name in data.get('unlocks', [])]
+    except KeyError as e: 
+        raise ValueError(f"{path}: unknown item {e.args[0]!r} in unlocks") from None
+    fields = {field: data[field] for field in ITEM_FIELDS if field in data}
+    fields.setdefault('restricted', False)
+    return Item(id=item_id, unlocks=unlocks, **fields)
+
+
+def _tile(data, item_ids, path): 
+    unknown = set(data) - set(TILE_FIELDS) - {'items'}
+    if unknown: 
+        raise ValueError(f"{path}: unknown tile fields {sorted(unknown)}")
+    try: 
+        items = [item_ids[name] for name in data.get('items', [])]
+    except KeyError as e: 
+        raise ValueError(f"{path}: unknown item {e.args[0]!r}") from None
+    return MapLocation(concealed=data['concealed'], 
+                       revealed=data['revealed'], 
+                       description=data.get('description'), 
+                       items=items)
+
+
+def parse_world(data, path='world'): 
+    item_names = list(data['items'])
+    item_ids = {name: item_id for item_id, name in enumerate(item_names)}
+    items = [_item(item_ids[name], fields, item_ids, f"{path}: items.{name}") for name, fields in data['items'].items()]
+
+    tiles = {name: _tile(fields, item_ids, f"{path}: tiles.{name}") for name, fields in data['tiles'].items()}
+
+    # the palette holds every tile once, palette[0] is an undeveloped tile
+    palette = [None] + list(tiles.values())
+    palette_index = {name: index + 1 for index, name in enumerate(tiles)}
+
+    legend = data['legend']
+    rows = data['map']
+    # "size" lets a big map leave out undeveloped space at the end of rows or at the bottom
+    height, width = data.get('size', (len(rows), max((len(row) for row in rows), default=0)))
+    if len(rows) > height or any(len(row) > width for row in rows): 
+        raise ValueError(f"{path}: map is bigger than its size {height}x{width}")
+    grid = ChunkedGrid(height, width, palette)
+    positions = {}
+    for y, row in enumerate(rows): 
+        for x, char in enumerate(row): 
+            if char not in legend: 
+                raise ValueError(f"{path}: map character {char!r} at {y},{x} is not in the legend")
+            name = legend[char]
+            if name is None: 
+                continue
+            if name not in tiles: 
+                raise ValueError(f"{path}: legend {char!r} refers to unknown tile {name!r}")
+            grid.set(y, x, palette_index[name])
+            positions.setdefault(name, []).append((y, x))
+
+    mutations = {}
+    for effect_name, effect in data.get('effects', {}).items(): 
+        effect_path = f"{path}: effects.{effect_name}"
+        changed_items = {}
+        for name, fields in effect.get('items', {}).items(): 
+            if name not in item_ids: 
+                raise ValueError(f"{effect_path}: unknown item {name!r}")
+            base = data['items'][name]
+            changed_items[item_ids[name]] = _item(item_ids[name], dict(base, **fields), item_ids, effect_path)
+        changed_tiles = {}
+        for name, fields in effect.get('tiles', {}).items(): 
+            if name not in tiles: 
+                raise ValueError(f"{effect_path}: unknown tile {name!r}")
+            changed = _tile(dict(data['tiles'][name], **fields), item_ids, effect_path)
+            for position in positions.get(name, []): 
+                changed_tiles[position] = changed
+        try: 
+            inventory = [item_ids[name] for name in effect.get('inventory', [])]
+        except KeyError as e: 
+            raise ValueError(f"{effect_path}: unknown item {e.args[0]!r} in inventory") from None
+        mutations[effect_name] = Mutation(items=changed_items, tiles=changed_tiles, inventory=inventory)
+
+    for item in items: 
+        if item.when_used and item.when_used not in mutations: 
+            raise ValueError(f"{path}: item {item.name!r} uses unknown effect {item.when_used!r}")
+
+    version = hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return World(items=items, grid=grid, start=data['start'], mutations=mutations, version=version)
+
+
+def pack_path(path): 
+    return os.path.splitext(path)[0] + '.pack'
+
+
+def compile_world(path, output=None): 
+    # world file -> pack, returns the World
+    # pack layout: PACK_HEADER (version, length of the world pickle), the pickled World without its chunks,
+    # then every chunk's raw palette indices, where each chunk is found is stored in World.grid.chunk_index
+    with open(path, encoding='utf-8') as f: 
+        world = parse_world(json.load(f), path)
+    output = output or pack_path(path)
+
+    chunks = world.grid.chunks
+    chunk_index = {}
+    offset = 0
+    for key, chunk in chunks.items(): 
+        chunk_index[key] = (offset, len(chunk))
+        offset += len(chunk) * chunk.itemsize
+    world.grid.chunk_index = chunk_index
+    skeleton = pickle.dumps(world, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # written to a temporary file first so a worker starting at the same time never reads half a pack
+    temporary = f"{output}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f: 
+        f.write(PACK_HEADER.pack(PACK_VERSION, len(skeleton)))
+        f.write(skeleton)
+        for chunk in chunks.values(): 
+            f.write(chunk.tobytes())
+    os.replace(temporary, output)
+    return world
+
+
+def load_pack(path): 
+    # only the world pickle is read now, chunks are read straight out of the mapped file when first needed
+    with open(path, 'rb') as f: 
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(data) < PACK_HEADER.size: 
+        return None
+    version, skeleton_length = PACK_HEADER.unpack_from(data)
+    if version != PACK_VERSION: 
+        return None
+    world = pickle.loads(data[PACK_HEADER.size:PACK_HEADER.size + skeleton_length])
+    chunks_start = PACK_HEADER.size + skeleton_length
+    chunk_index = world.grid.chunk_index
+    view = memoryview(data)
+
+    def load_chunk(key): 
+        location = chunk_index.get(key)
+        if location is None: 
+            return None
+        offset, length = location
+        start = chunks_start + offset
+        return view[start:start + length * 4].cast('I')
+
+    world.grid.loader = load_chunk
+    return world
+
+
+def build_world(path=None): 
+    # loads the compiled pack if it is newer than the world file, otherwise (re)compiles it
+    path = path or os.environ.get('WORLD_FILE', DEFAULT_WORLD)
+    pack = pack_path(path)
+    try: 
+        if os.path.getmtime(pack) >= os.path.getmtime(path): 
+            world = load_pack(pack)
+            if world is not None: 
+                return world
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError): 
+        # missing, empty or damaged pack, just rebuild it
+        pass
+    try: 
+        return compile_world(path, pack)
+    except OSError: 
+        # read-only install, the world still works without a cached pack
+        with open(path, encoding='utf-8') as f: 
+            return parse_world(json.load(f), path)
+
+
+if __name__ == '__main__': 
+    # python world.py [worlds/some_world.json ...] compiles packs ahead of time
+    # imported by name so the pickled classes are world.World etc. rather than __main__.World
+    from world import compile_world, pack_path, DEFAULT_WORLD
+    for world_file in sys.argv[1:] or [DEFAULT_WORLD]: 
+        compiled = compile_world(world_file)
+        print(f"{world_file} -> {pack_path(world_file)} ({len(compiled.items)} items, {compiled.height}x{compiled.width} map, {len(compiled.grid.chunks)} chunks)")